@@ -1,9 +1,42 @@
 import streamlit as st
 import gspread
+from gspread.exceptions import APIError
+from google.auth.exceptions import RefreshError, TransportError
 from google.oauth2.service_account import Credentials
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import numpy as np
+import requests
+from gspread.utils import rowcol_to_a1
+from abc import ABC, abstractmethod
+from contextlib import closing, nullcontext
 from datetime import datetime
+import csv
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
 import time
+import unicodedata
+import uuid
+from functools import lru_cache
+
+# 読み込んだ表を各セッションへコピーせずに渡すため、pandas 2 でも Copy-on-Write を有効にする（3以降は常に有効）
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+try:
+    import pykakasi  # 漢字の読み仮名（requirements.txt に含む。なければカタカナをひらがなに揃えるだけ）
+except ImportError:
+    pykakasi = None
+
+try:
+    import openpyxl  # Excelファイルからの一括追加（requirements.txt に含む。なければCSVと貼り付けのみ）
+except ImportError:
+    openpyxl = None
 
 # ページ設定
 st.set_page_config(
@@ -574,6 +607,13 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+def get_setting(key, default):
+    """secretsから設定値を取得（未設定の場合は既定値）"""
+    try:
+        return st.secrets.get(key, default)
+    except Exception:
+        return default
+
 # Google Sheets接続設定
 @st.cache_resource
 def get_google_sheets_client():
@@ -597,136 +637,2193 @@ def get_google_sheets_client():
         st.error(f"Google Sheets接続エラー: {e}")
         return None
 
-def load_data(sheet):
-    """スプレッドシートからデータを読み込む"""
-    try:
-        data = sheet.get_all_records()
-        if not data:
-            # データが空の場合は空のDataFrameを返す
-            return pd.DataFrame(columns=["No", "名前", "1次会", "2次会", "コメント", "更新日時"])
-        
-        df = pd.DataFrame(data)
-        
-        # 古い形式から新しい形式への変換
-        if "ID" in df.columns and "No" not in df.columns:
-            df = df.rename(columns={"ID": "No"})
-        
-        if "出席" in df.columns and "1次会" not in df.columns:
-            # 出席列を1次会に変換、2次会は新規作成
-            df = df.rename(columns={"出席": "1次会"})
-            df["2次会"] = ""
-        
-        # 必須カラムの確認と追加
-        required_columns = ["No", "名前", "1次会", "2次会", "コメント", "更新日時"]
-        for col in required_columns:
-            if col not in df.columns:
-                df[col] = ""
-        
-        # 出席列を文字列型に変換（"出席"、"欠席"、""のいずれか）
-        if "1次会" in df.columns:
-            df["1次会"] = df["1次会"].astype(str)
-            df["1次会"] = df["1次会"].replace({"TRUE": "出席", "FALSE": "", "nan": ""})
-        if "2次会" in df.columns:
-            df["2次会"] = df["2次会"].astype(str)
-            df["2次会"] = df["2次会"].replace({"TRUE": "出席", "FALSE": "", "nan": ""})
-        
-        # カラムの順序を統一
-        df = df[required_columns]
+def is_auth_error(e):
+    """認証切れのエラーかどうか"""
+    return isinstance(e, RefreshError) or (isinstance(e, APIError) and e.code == 401)
+
+def is_handle_error(e):
+    """開き直しで回復できるエラー（認証切れ・404）かどうか"""
+    return is_auth_error(e) or (isinstance(e, APIError) and e.code == 404)
+
+def is_retryable_error(e):
+    """待てば成功する可能性があるエラー（429 レート制限・5xx サーバーエラー）かどうか"""
+    return isinstance(e, APIError) and (e.code == 429 or e.code >= 500)
+
+def is_connection_error(e):
+    """Google Sheetsに接続できないエラー（ネットワークの切断・タイムアウト）かどうか"""
+    return isinstance(e, (ConnectionError, TimeoutError, requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout, TransportError))
+
+# 読み込みのAPI（5xxでも再試行する）
+READ_METHODS = {
+    "get_all_records", "get_all_values", "get_values", "batch_get", "col_values", "row_values",
+    "get_lastUpdateTime", "fetch_sheet_metadata", "worksheets", "worksheet", "get_worksheet",
+    "values_batch_get",
+}
+
+# 同じ内容で再送しても結果が変わらない書き込み（5xxでも再試行する）
+IDEMPOTENT_METHODS = {"update", "batch_update", "clear"}
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、新たに実行せずにその結果（またはエラー）を待って受け取る"""
+    
+    def __init__(self):
+        self._flights = {}  # 実行中のキー -> {"done": Event, "result": ..., "error": ...}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn, *args):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+        
+        try:
+            flight["result"] = fn(*args)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight["done"].set()
+
+class ApiLimiter:
+    """Sheets APIの呼び出しをプロセス全体で制御する（全セッションで共有）
+    
+    呼び出しごとにトークンバケットから1つ取り、平均 rate 回/秒（最大 burst 回まで連続）に抑える。
+    429 と 5xx は指数バックオフ（ジッター付き）で max_retries 回まで再試行し、429 を受けたら
+    バケットを空にして他の呼び出しも待たせる。追加・削除のように再送すると結果が変わる書き込みは、
+    実行されていないことが確実な 429 の場合だけ再試行する。
+    同じデータの読み込みをまとめるのは DataCache が行う（書き込みの前後を区別できるよう世代ごとにまとめる）。
+    """
+    
+    def __init__(self, rate, burst, max_retries, max_backoff=32.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def wrap(self, target):
+        """target（Worksheet / Spreadsheet）のメソッド呼び出しをこのリミッター経由にしたものを返す"""
+        return LimitedProxy(target, self)
+    
+    def call(self, fn, *args, name=None, **kwargs):
+        """fn(*args, **kwargs) を実行する（name はメソッド名で、再試行してよいかの判定に使う）"""
+        return self._call_with_retry(fn, args, kwargs, name)
+    
+    def _call_with_retry(self, fn, args, kwargs, name):
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable_error(e) and (
+                    e.code == 429 or name in READ_METHODS or name in IDEMPOTENT_METHODS
+                )
+                if not retryable or attempt == self.max_retries:
+                    raise
+                if e.code == 429:
+                    self._drain()
+                # 同時に失敗した呼び出しが一斉に再送しないよう、待ち時間はランダムにずらす
+                time.sleep(random.uniform(0, min(self.max_backoff, 2 ** attempt)))
+    
+    def _acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+    
+    def _drain(self):
+        with self._lock:
+            self._tokens = 0
+            self._refilled_at = time.monotonic()
+
+class LimitedProxy:
+    """Worksheet / Spreadsheet の代わりに、メソッド呼び出しを ApiLimiter 経由で行う"""
+    
+    def __init__(self, target, limiter):
+        self._target = target
+        self._limiter = limiter
+    
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if isinstance(value, (gspread.Worksheet, gspread.Spreadsheet)):
+            return LimitedProxy(value, self._limiter)
+        if not callable(value):
+            return value
+        
+        def call(*args, **kwargs):
+            result = self._limiter.call(value, *args, name=name, **kwargs)
+            if isinstance(result, (gspread.Worksheet, gspread.Spreadsheet)):
+                return LimitedProxy(result, self._limiter)
+            return result
+        return call
+
+@st.cache_resource
+def get_api_limiter():
+    """プロセス全体で共有するSheets APIのリミッターを取得"""
+    return ApiLimiter(
+        rate=float(get_setting("api_rate", 1.0)),
+        burst=float(get_setting("api_burst", 10)),
+        max_retries=int(get_setting("api_max_retries", 5)),
+    )
+
+class WorksheetHandle:
+    """開いたワークシートを保持し、認証切れや404の場合は開き直す
+    
+    再実行のたびに open_by_key とワークシートのメタデータ取得を行わないよう、
+    プロセス内でワークシートごとに1つのハンドルを使い回す。worksheet を省略すると最初のシートを開く。
+    """
+    
+    def __init__(self, spreadsheet_id, check_interval, worksheet=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheet = worksheet
+        self.key = worksheet_key(spreadsheet_id, worksheet)
+        self.check_interval = check_interval
+        self._sheet = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def get(self):
+        """ワークシートを取得（未オープン・無効化済みの場合は開く）"""
+        with self._lock:
+            if self._sheet is None:
+                self._open()
+            elif time.monotonic() - self._checked_at > self.check_interval:
+                self._check()
+            return self._sheet
+    
+    def invalidate(self, error=None):
+        """ハンドルを破棄し、次回の get で開き直す"""
+        with self._lock:
+            self._sheet = None
+            # 認証エラーの場合はクライアントも作り直す
+            if is_auth_error(error):
+                get_google_sheets_client.clear()
+    
+    def run(self, fn, *args):
+        """fn(sheet, *args) を実行し、開き直しで回復できるエラーなら1度だけ再試行する"""
+        try:
+            return fn(self.get(), *args)
+        except Exception as e:
+            if not is_handle_error(e):
+                raise
+            self.invalidate(e)
+            return fn(self.get(), *args)
+    
+    def _open(self):
+        client = get_google_sheets_client()
+        if client is None:
+            raise RuntimeError("Google Sheetsに接続できません")
+        # API呼び出しはすべてプロセス共有のリミッターを通す
+        limiter = get_api_limiter()
+        spreadsheet = limiter.wrap(limiter.call(client.open_by_key, self.spreadsheet_id, name="open_by_key"))
+        # イベント（ワークシート名）の指定がなければ最初のシートを使用
+        self._sheet = spreadsheet.worksheet(self.worksheet) if self.worksheet else spreadsheet.get_worksheet(0)
+        self._checked_at = time.monotonic()
+    
+    def _check(self):
+        """ヘルスチェック（軽量なメタデータ取得で、開いたままのハンドルが有効か確認）"""
+        try:
+            self._sheet.spreadsheet.fetch_sheet_metadata({"fields": "spreadsheetId"})
+            self._checked_at = time.monotonic()
+        except Exception as e:
+            if not is_handle_error(e):
+                raise
+            if is_auth_error(e):
+                get_google_sheets_client.clear()
+            self._open()
+
+def worksheet_key(spreadsheet_id, worksheet=None):
+    """キャッシュや書き込みキューを共有する単位（ワークシートの指定がなければスプレッドシートID）"""
+    return spreadsheet_id if worksheet is None else f"{spreadsheet_id}/{worksheet}"
+
+@st.cache_resource
+def get_worksheet_handle(spreadsheet_id, worksheet=None):
+    """ワークシートごとのハンドルを取得（プロセス全体で共有）"""
+    return WorksheetHandle(spreadsheet_id, check_interval=float(get_setting("handle_check_interval", 300)), worksheet=worksheet)
+
+# スプレッドシートの列構成
+COLUMNS = ["No", "名前", "1次会", "2次会", "コメント", "更新日時"]
+
+# 出欠操作で変更される列
+ATTENDANCE_COLUMNS = ["1次会", "2次会", "更新日時"]
+
+# 出欠の値（カテゴリの順序は出席者優先の並び順）
+ATTENDANCE_DTYPE = pd.CategoricalDtype(["出席", "欠席", ""], ordered=True)
+
+def intern_strings(values):
+    """文字列を sys.intern で共有した object 型の列にする（同じ名前・コメントは再読み込みをまたいで1つ）"""
+    return pd.Series([sys.intern(str(v)) for v in values], dtype=object)
+
+def attendance_column(values):
+    """出欠の列をカテゴリ型にする（旧形式のTRUE/FALSEを変換し、それ以外の値は未選択として扱う）"""
+    values = pd.Series(values, dtype=object).replace({"TRUE": "出席", "FALSE": "", True: "出席", False: ""})
+    return pd.Series(pd.Categorical(values, dtype=ATTENDANCE_DTYPE)).fillna("")
+
+def compact_roster(df):
+    """表を省メモリの型に揃える（No は int32、出欠はカテゴリ、文字列の列は intern した object）"""
+    compact = pd.DataFrame({
+        "No": pd.to_numeric(pd.Series(df["No"], dtype=object), errors="coerce").fillna(0).astype(np.int32).to_numpy(),
+        "名前": intern_strings(df["名前"]),
+        "1次会": attendance_column(df["1次会"]),
+        "2次会": attendance_column(df["2次会"]),
+        "コメント": intern_strings(df["コメント"]),
+        "更新日時": intern_strings(df["更新日時"]),
+    })
+    compact.attrs.update(df.attrs)
+    return compact
+
+def wire_rows(df):
+    """表の各行をSheetsに書き込む値のリストとして1行ずつ返す（DataFrameはコピーしない）"""
+    for cells in zip(*(df[col] for col in COLUMNS)):
+        yield list(cells)
+
+# シートの列構成のバージョン（1: 旧形式 ID/名前/出席/コメント/更新日時、2: 現行の COLUMNS）
+SCHEMA_VERSION = 2
+
+# スキーマのバージョンを記録するワークシートの開発者メタデータのキー
+SCHEMA_METADATA_KEY = "attendance_schema_version"
+
+# 旧形式の列名 -> 現行の列名（現行の列がない場合だけ読み替える）
+LEGACY_HEADERS = {"ID": "No", "出席": "1次会"}
+
+# シート上の出欠の値 -> ATTENDANCE_DTYPE のコード（旧形式のチェックボックスも変換し、それ以外は未選択）
+ATTENDANCE_VALUE_CODES = {"出席": 0, "欠席": 1, "": 2, "TRUE": 0, "FALSE": 2}
+
+@lru_cache(maxsize=32)
+def header_mapping(header):
+    """シートのヘッダー（タプル）から、COLUMNS の各列が何列目にあるか（ない列はNone）を求める
+    
+    ヘッダーの形ごとに1回だけ計算する。旧形式の ID は No、出席は 1次会 として読む。
+    """
+    positions = {}
+    for i, name in enumerate(header):
+        if name in LEGACY_HEADERS and LEGACY_HEADERS[name] not in header:
+            name = LEGACY_HEADERS[name]
+        positions.setdefault(name, i)
+    return tuple(positions.get(col) for col in COLUMNS)
+
+def read_data(sheet, schema_version=None):
+    """スプレッドシートからデータを読み込む（エラーは呼び出し元に送出）
+    
+    get_values でセルを文字列のまま取得し、header_mapping で求めた列位置から
+    1回の走査で compact_roster と同じ型の表を作る。schema_version が現行（移行済み）の
+    シートはヘッダーを調べず、COLUMNS の順に並んでいるものとして読む。
+    """
+    values = sheet.get_values()
+    trusted = schema_version == SCHEMA_VERSION
+    header = [] if trusted or not values else list(values[0])
+    while header and header[-1] == "":
+        header.pop()
+    if len(values) < 2:
+        # データが空の場合は空のDataFrameを返す
+        df = compact_roster(pd.DataFrame(columns=COLUMNS))
+        df.attrs["header"] = header
+        return df
+    
+    # ない列は、常に空欄になる末尾の位置から読む
+    width = max(len(header), len(COLUMNS), max(len(row) for row in values))
+    mapping = tuple(range(len(COLUMNS))) if trusted else header_mapping(tuple(header))
+    positions = [width if p is None else p for p in mapping]
+    blanks = [""] * (width + 1)
+    no_pos, name_pos, first_pos, second_pos, comment_pos, updated_pos = positions
+    
+    nos, names, first, second, comments, updated = [], [], [], [], [], []
+    for row in values[1:]:
+        row = row + blanks[len(row):]
+        try:
+            nos.append(int(row[no_pos]))
+        except ValueError:
+            nos.append(0)
+        names.append(sys.intern(row[name_pos]))
+        first.append(ATTENDANCE_VALUE_CODES.get(row[first_pos], 2))
+        second.append(ATTENDANCE_VALUE_CODES.get(row[second_pos], 2))
+        comments.append(sys.intern(row[comment_pos]))
+        updated.append(sys.intern(row[updated_pos]))
+    
+    df = pd.DataFrame({
+        "No": np.array(nos, dtype=np.int32),
+        "名前": pd.Series(names, dtype=object),
+        "1次会": pd.Categorical.from_codes(first, dtype=ATTENDANCE_DTYPE),
+        "2次会": pd.Categorical.from_codes(second, dtype=ATTENDANCE_DTYPE),
+        "コメント": pd.Series(comments, dtype=object),
+        "更新日時": pd.Series(updated, dtype=object),
+    })
+    # シート上のヘッダーが現行の列構成と異なる場合は、全体を書き直して移行する
+    df.attrs["needs_migration"] = not trusted and header != COLUMNS
+    df.attrs["header"] = header
+    return df
+
+def read_schema_version(sheet):
+    """ワークシートに記録したスキーマのバージョンを返す（未記録ならNone。エラーは呼び出し元に送出）"""
+    metadata = sheet.spreadsheet.fetch_sheet_metadata({
+        "fields": "sheets(properties(sheetId),developerMetadata(metadataKey,metadataValue))",
+    })
+    for entry in metadata.get("sheets", []):
+        if entry.get("properties", {}).get("sheetId") != sheet.id:
+            continue
+        for item in entry.get("developerMetadata", []):
+            if item.get("metadataKey") == SCHEMA_METADATA_KEY:
+                return int(item["metadataValue"])
+    return None
+
+def write_schema_version(sheet, version):
+    """ワークシートの開発者メタデータにスキーマのバージョンを記録（エラーは呼び出し元に送出）"""
+    location = {"sheetId": sheet.id}
+    sheet.spreadsheet.batch_update({"requests": [
+        {"deleteDeveloperMetadata": {"dataFilter": {"developerMetadataLookup": {
+            "metadataKey": SCHEMA_METADATA_KEY, "metadataLocation": location,
+        }}}},
+        {"createDeveloperMetadata": {"developerMetadata": {
+            "metadataKey": SCHEMA_METADATA_KEY, "metadataValue": str(version),
+            "location": location, "visibility": "DOCUMENT",
+        }}},
+    ]})
+
+def migrate_sheet(sheet, row_index=None, dry_run=False):
+    """シートを現行のスキーマに移行し、(移行後のデータ, 移行内容) を返す（エラーは呼び出し元に送出）
+    
+    旧形式のシートは現行の列構成で全体を書き直し、スキーマのバージョンをワークシートに記録する。
+    記録済みのシートは何もしない。dry_run では書き込まずに移行内容だけを返す。
+    移行内容は {"schema_version": 記録済みのバージョン, "header": 移行前のヘッダー,
+    "rows": 行数, "rewrite": 全体を書き直すかどうか}。
+    """
+    with row_index.lock if row_index is not None else nullcontext():
+        # 他のセッション・プロセスが移行済みの場合は書き直さない
+        schema_version = read_schema_version(sheet)
+        df = read_data(sheet, schema_version)
+        plan = {
+            "schema_version": schema_version,
+            "header": df.attrs["header"],
+            "rows": len(df),
+            "rewrite": df.attrs.get("needs_migration", False),
+        }
+        if dry_run or schema_version == SCHEMA_VERSION:
+            return df, plan
+        
+        if plan["rewrite"]:
+            write_data(sheet, df)
+            df.attrs["needs_migration"] = False
+        write_schema_version(sheet, SCHEMA_VERSION)
+        if row_index is not None:
+            row_index.rebuild(df["No"].tolist())
+        return df, plan
+
+class RowIndex:
+    """Noからシート上の行番号への対応表（スプレッドシートごとに共有）
+    
+    全件読み込みのたびに作り直し、自分で行った追加・削除は差分で反映する。
+    行番号の解決から書き込みまでの間に行がずれないよう、セルの書き込みと行の追加・削除は lock で直列化する。
+    """
+    
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built = False
+        self.needs_migration = False
+        self.generation = 0  # 追加・削除のたびに進める
+        self._rows = {}  # str(No) -> 行番号
+        self._next_row = 2
+    
+    def rebuild(self, nos, needs_migration=False, generation=None):
+        """シート順のNo一覧から作り直す。generation が変わっていれば（読み込み中に追加・削除があれば）何もしない"""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            # 1行目はヘッダー
+            self._rows = {str(no): i + 2 for i, no in enumerate(nos)}
+            self._next_row = len(nos) + 2
+            self.needs_migration = needs_migration
+            self.built = True
+    
+    def get(self, no):
+        """Noの行番号を返す。見つからなければNone"""
+        return self._rows.get(str(no))
+    
+    def add(self, no):
+        """末尾に追加した行を反映"""
+        with self.lock:
+            self._rows[str(no)] = self._next_row
+            self._next_row += 1
+            self.generation += 1
+    
+    def remove(self, no):
+        """削除した行を反映（後ろの行を1つずつ繰り上げる）"""
+        with self.lock:
+            row = self._rows.pop(str(no), None)
+            if row is None:
+                return
+            for key, other in self._rows.items():
+                if other > row:
+                    self._rows[key] = other - 1
+            self._next_row -= 1
+            self.generation += 1
+
+class DataCache:
+    """ワークシート（イベント）ごとの読み込みキャッシュ（全セッションで共有）
+    
+    TTL内はメモリから返し、TTL切れ後はDriveのmodifiedTimeで変更の有無を確認して、
+    変わっていなければ再読み込みせずにTTLを延長する。自分の書き込み後は invalidate で破棄する。
+    読み込むたびに idle_timeout 秒使われていないデータを破棄し、max_entries を超えた分は
+    使われていない順に破棄するため、メモリに残るのは表示中のイベントだけになる。
+    行番号の対応表は小さく、書き込みに必要なため破棄しない。
+    
+    同じワークシートの再読み込みが同時に必要になった場合は、1つのセッションだけが読み込み、
+    他のセッションはその結果を受け取る（SingleFlight）。受け取ったDataFrameはCopy-on-Writeの
+    浅いコピーで、変更してもキャッシュや他のセッションには影響しない。invalidate 後の読み込みは、
+    それ以前から実行中の読み込みには相乗りしない。
+    接続できない（切断・429・5xx）ために読み込めない間は、最後に読めた内容を返す。
+    """
+    
+    def __init__(self, ttl, max_entries=None, idle_timeout=None, auto_migrate=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self.auto_migrate = auto_migrate
+        self._entries = {}  # key -> (df, version, fetched_at)
+        self._used = {}     # key -> 最後に読まれた時刻
+        self._indexes = {}  # key -> RowIndex（データを破棄しても差分更新で保持する）
+        self._generations = {}  # key -> invalidate された回数
+        self._schemas = {}  # key -> ワークシートに記録されたスキーマのバージョン（プロセスで1回だけ確認）
+        self._stale = {}    # key -> 最後に読めたDataFrame（invalidate 後も、読み込みに失敗した時のために残す）
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+    
+    def load(self, sheet, key=None):
+        key = key or sheet.spreadsheet_id
+        with self._lock:
+            entry = self._entries.get(key)
+            self._used[key] = time.monotonic()
+            generation = self._generations.get(key, 0)
+        
+        if entry is not None:
+            df, version, fetched_at = entry
+            if time.monotonic() - fetched_at < self.ttl:
+                return df.copy(deep=False)
+        
+        try:
+            df = self._flights.do((key, generation), self._refresh, sheet, key, generation)
+        except Exception as e:
+            with self._lock:
+                stale = self._stale.get(key)
+            if stale is None or not (is_connection_error(e) or is_retryable_error(e)):
+                raise
+            # 接続できない間は最後に読めた内容を返す（次の読み込みで再び確認する）
+            df = stale
+        return df.copy(deep=False)
+    
+    def _refresh(self, sheet, key, generation):
+        """変更を確認し、必要なら読み込み直してキャッシュに入れる（SingleFlightの中で1回だけ実行）"""
+        with self._lock:
+            entry = self._entries.get(key)
+        
+        # 読み込み中の書き込みを取りこぼさないよう、バージョンはデータより先に取得する
+        current_version = self._fetch_version(sheet)
+        if entry is not None and current_version is not None and current_version == entry[1]:
+            df = entry[0]
+            self._store(key, generation, (df, current_version, time.monotonic()))
+            return df
         
+        index = self._index(key)
+        index_generation = index.generation
+        schema_version = self._schema_version(sheet, key)
+        df = read_data(sheet, schema_version)
+        index.rebuild(df["No"].tolist(), df.attrs.get("needs_migration", False), index_generation)
+        if schema_version != SCHEMA_VERSION and self.auto_migrate:
+            # 未移行のシートは最初の読み込みで1回だけ移行し、以降はヘッダーを調べずに読む
+            try:
+                df, _ = migrate_sheet(sheet, index)
+                with self._lock:
+                    self._schemas[key] = SCHEMA_VERSION
+                current_version = self._fetch_version(sheet)
+            except Exception:
+                # 書き込めない場合は旧形式のまま表示し、最初の書き込み時に移行する
+                pass
+        self._store(key, generation, (df, current_version, time.monotonic()))
         return df
-    except Exception as e:
-        st.error(f"データ読み込みエラー: {e}")
-        return pd.DataFrame(columns=["No", "名前", "1次会", "2次会", "コメント", "更新日時"])
+    
+    def _store(self, key, generation, entry):
+        with self._lock:
+            # 読み込み中に invalidate された場合、書き込み前の内容の可能性があるため保存しない
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = entry
+                self._stale[key] = entry[0]
+                self._evict()
+    
+    def row_index(self, sheet, key=None):
+        """ワークシートの行番号対応表を取得（未作成の場合は読み込んで作る）"""
+        key = key or sheet.spreadsheet_id
+        index = self._index(key)
+        if not index.built:
+            df = self.load(sheet, key)
+            index.rebuild(df["No"].tolist(), df.attrs.get("needs_migration", False))
+        return index
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+    
+    def _evict(self):
+        now = time.monotonic()
+        keys = self._entries.keys() | self._stale.keys()
+        evicted = set()
+        if self.idle_timeout is not None:
+            evicted |= {key for key in keys if now - self._used.get(key, 0) > self.idle_timeout}
+        if self.max_entries is not None:
+            remaining = sorted(keys - evicted, key=lambda key: self._used.get(key, 0))
+            evicted |= set(remaining[:max(len(remaining) - self.max_entries, 0)])
+        for key in evicted:
+            self._entries.pop(key, None)
+            self._stale.pop(key, None)
+    
+    def _index(self, key):
+        with self._lock:
+            return self._indexes.setdefault(key, RowIndex())
+    
+    def _schema_version(self, sheet, key):
+        with self._lock:
+            if key in self._schemas:
+                return self._schemas[key]
+        try:
+            schema_version = read_schema_version(sheet)
+        except Exception:
+            # 確認できない場合はヘッダーから判定し、次回の読み込みで確認し直す
+            return None
+        with self._lock:
+            self._schemas[key] = schema_version
+        return schema_version
+    
+    @staticmethod
+    def _fetch_version(sheet):
+        """変更確認用のバージョン（DriveのmodifiedTime）を取得。取得できない場合はNone"""
+        try:
+            return sheet.spreadsheet.get_lastUpdateTime()
+        except Exception:
+            return None
 
-def save_data(sheet, df):
-    """DataFrameをスプレッドシートに保存"""
-    try:
-        # 出席列はそのまま保存（"出席"、"欠席"、""のいずれか）
-        df_copy = df.copy()
+@st.cache_resource
+def get_data_cache():
+    """プロセス全体で共有する読み込みキャッシュを取得"""
+    return DataCache(
+        ttl=float(get_setting("cache_ttl", 30)),
+        max_entries=int(get_setting("event_cache_size", 4)),
+        idle_timeout=float(get_setting("event_idle_timeout", 600)),
+        auto_migrate=bool(get_setting("auto_migrate", True)),
+    )
+
+def write_data(sheet, df):
+    """DataFrameでスプレッドシート全体を書き直す（エラーは呼び出し元に送出）"""
+    # 出席列はそのまま保存（"出席"、"欠席"、""のいずれか）
+    # ヘッダーとデータを結合
+    data_to_save = [COLUMNS] + list(wire_rows(df))
+    
+    # スプレッドシート全体を更新
+    sheet.clear()
+    sheet.update(data_to_save, value_input_option='RAW')
+
+def read_rows(sheet, row_index, nos):
+    """Noの参加者の行を1回のbatch_getで読み、{str(No): セル値のリスト} を返す（エラーは呼び出し元に送出）"""
+    for attempt in range(2):
+        rows = {str(no): row_index.get(no) for no in nos}
+        missing = any(row is None for row in rows.values())
+        rows = {no: row for no, row in rows.items() if row is not None}
+        ranges = [f"A{row}:{rowcol_to_a1(row, len(COLUMNS))}" for row in rows.values()]
+        values = sheet.batch_get(ranges) if ranges else []
+        
+        current = {}
+        for (no, row), value_range in zip(rows.items(), values):
+            cells = [str(v) for v in (value_range[0] if value_range else [])]
+            current[no] = cells + [""] * (len(COLUMNS) - len(cells))
+        
+        # 対応表にないNo（他の端末で追加された行）があるか、他の端末の追加・削除で行がずれていれば、
+        # No列から対応表を作り直して読み直す
+        if attempt == 0 and (missing or any(cells[0] != no for no, cells in current.items())):
+            row_index.rebuild(sheet.col_values(1)[1:], row_index.needs_migration)
+            continue
+        return {no: cells for no, cells in current.items() if cells[0] == no}
+
+# 他の端末で削除された参加者への変更を競合として返すときの「他の端末の値」
+DELETED_LABEL = "削除"
+
+def merge_changes(current, changes):
+    """変更セル(No, 列名, 値, 元の値)を現在の行の値と突き合わせ、(書き込むセル, 競合した変更) を返す
+    
+    current は {str(No): 現在のセル値のリスト（COLUMNS順、文字列）}。
+    行の更新日時が編集を始めた時点（"更新日時"の元の値）から変わっていなければそのまま書き込む。
+    他の端末が同じ行を更新していた場合はセルごとに比較し、他の端末が変更していないセルだけを
+    書き込む（自動マージ）。元の値がNoneの変更は無条件に書き込む。
+    書き込むセルは (No, 列名, 値)、競合した変更は (No, 列名, 値, 他の端末の値) のリスト。
+    他の端末で削除された参加者（current にないNo）への変更は、他の端末の値を DELETED_LABEL として競合に含める。
+    """
+    base_timestamps = {no: base for no, col, _, base in changes if col == "更新日時"}
+    timestamps = {no: value for no, col, value, _ in changes if col == "更新日時"}
+    
+    writes = []
+    conflicts = []
+    written = {}
+    for no, col, value, base in changes:
+        cells = current.get(str(no))
+        if col == "更新日時":
+            # 更新日時はセルを書き込んだ行にだけ書く
+            continue
+        if cells is None:
+            # 他の端末で削除された参加者への変更は書き込まず、競合として知らせる
+            conflicts.append((no, col, value, DELETED_LABEL))
+            continue
+        
+        current_value = cells[COLUMNS.index(col)]
+        unchanged_row = no in base_timestamps and cells[COLUMNS.index("更新日時")] == str(base_timestamps[no])
+        if current_value == str(value):
+            continue
+        if base is not None and not unchanged_row and current_value != str(base):
+            # 他の端末が同じセルを変更していた場合は、そちらを優先する
+            conflicts.append((no, col, value, current_value))
+            continue
+        
+        writes.append((no, col, value))
+        written[no] = True
+    
+    writes += [(no, "更新日時", timestamps[no]) for no in written if no in timestamps]
+    return writes, conflicts
+
+def write_changes(sheet, row_index, changes):
+    """変更セル(No, 列名, 値, 元の値)を1回のbatch_updateで書き込み、競合した変更を返す（エラーは呼び出し元に送出）
+    
+    書き込む前に対象の行を1回のbatch_getで読み直し、merge_changes で他の端末の変更と突き合わせる。
+    """
+    if not changes:
+        return []
+    
+    with row_index.lock:
+        # 旧形式のシートは列位置が異なるため、変更を反映した上で全体を書き直す
+        if row_index.needs_migration:
+            df = read_data(sheet)
+            for no, col, value, _ in changes:
+                df.loc[df["No"] == no, col] = value
+            write_data(sheet, df)
+            row_index.rebuild(df["No"].tolist())
+            return []
+        
+        current = read_rows(sheet, row_index, {no for no, _, _, _ in changes})
+        writes, conflicts = merge_changes(current, changes)
+        data = [{
+            "range": rowcol_to_a1(row_index.get(no), COLUMNS.index(col) + 1),
+            "values": [[str(value)]],
+        } for no, col, value in writes]
         
-        # ヘッダーとデータを結合
-        data_to_save = [df_copy.columns.tolist()] + df_copy.values.tolist()
+        if data:
+            sheet.batch_update(data, value_input_option='RAW')
+        return conflicts
+
+def append_rows_data(sheet, row_index, names):
+    """参加者をまとめて追加し、割り当てたNoのリストを返す（No列の読み直し1回と append_rows 1回）"""
+    if not names:
+        return []
+    with row_index.lock:
+        if row_index.needs_migration:
+            # 旧形式のシートは列位置が異なるため、移行を兼ねて全体を書き直す
+            df = read_data(sheet)
+            first_no = int(df["No"].max()) + 1 if len(df) > 0 else 1
+            new_nos = list(range(first_no, first_no + len(names)))
+            new_rows = compact_roster(pd.DataFrame({"No": new_nos, "名前": names, "1次会": "", "2次会": "", "コメント": "", "更新日時": ""}))
+            df = pd.concat([df, new_rows], ignore_index=True)
+            write_data(sheet, df)
+            row_index.rebuild(df["No"].tolist())
+            return new_nos
+        
+        # 他の端末で追加された行とNoが重複しないよう、No列を読み直して採番する
+        nos = sheet.col_values(1)
+        first_no = max((int(no) for no in nos[1:] if str(no).isdigit()), default=0) + 1
+        new_nos = list(range(first_no, first_no + len(names)))
+        rows = [[no, name, "", "", "", ""] for no, name in zip(new_nos, names)]
+        if not nos:
+            # ヘッダーもない空のシートにはヘッダーから書き込む
+            sheet.append_rows([COLUMNS] + rows, value_input_option='RAW')
+            row_index.rebuild(new_nos)
+            return new_nos
+        
+        row_index.rebuild(nos[1:], row_index.needs_migration)
+        sheet.append_rows(rows, value_input_option='RAW', table_range="A1")
+        for no in new_nos:
+            row_index.add(no)
+        return new_nos
+
+def delete_row_data(sheet, row_index, no):
+    """Noの参加者の行を削除する。行が見つからなければFalse（エラーは呼び出し元に送出）"""
+    with row_index.lock:
+        row = row_index.get(no)
         
-        # スプレッドシート全体を更新
-        sheet.clear()
-        sheet.update(data_to_save, value_input_option='RAW')
+        # 他の端末の追加・削除で行がずれていないか、削除前に行のNoを確認する
+        if row is None or sheet.row_values(row)[:1] != [str(no)]:
+            nos = sheet.col_values(1)
+            row_index.rebuild(nos[1:], row_index.needs_migration)
+            row = row_index.get(no)
+            if row is None:
+                return False
+        
+        sheet.delete_rows(row)
+        row_index.remove(no)
         return True
+
+def diff_cells(base_df, df, columns=ATTENDANCE_COLUMNS):
+    """読み込み時のスナップショットと編集後のDataFrameを比較し、変更セルを(No, 列名, 値, 元の値)のリストで返す"""
+    base = base_df.set_index("No")[columns]
+    # 表示用に並び替えられていてもNoで突き合わせる（スナップショットにない行は対象外）
+    edited = df.set_index("No")[columns].reindex(base.index)
+    changed = (edited != base) & edited.notna()
+    
+    changes = []
+    for col in columns:
+        for no in changed.index[changed[col].to_numpy()]:
+            changes.append((no, col, edited.at[no, col], base.at[no, col]))
+    return changes
+
+class StorageBackend(ABC):
+    """出席簿の保存先の共通インターフェース
+    
+    load は COLUMNS の列構成のDataFrameを返す。update_cells は変更セル(No, 列名, 値, 元の値)を
+    まとめて反映し、他の端末の変更と競合した変更を返す（扱いは merge_changes と同じ）。
+    append は割り当てたNoを、append_many は名前の順に割り当てたNoのリストを、delete は
+    削除できたかどうかを返す。エラーは呼び出し元に送出する。
+    subscribe で登録した関数は、このプロセスから書き込むたびに key を引数に呼ばれる。
+    poll_changes は他のプロセスや端末からの変更を軽い確認で検知し、変更があればTrueを返す。
+    load・update_cells・append_many・delete は各バックエンドが実装する（未実装なら作成時にTypeError）。
+    """
+    
+    def __init__(self, key):
+        self.key = key  # キャッシュや書き込みキューを共有する単位
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+    
+    @abstractmethod
+    def load(self):
+        ...
+    
+    @abstractmethod
+    def update_cells(self, changes):
+        ...
+    
+    def append(self, name):
+        return self.append_many([name])[0]
+    
+    @abstractmethod
+    def append_many(self, names):
+        ...
+    
+    @abstractmethod
+    def delete(self, no):
+        ...
+    
+    def poll_changes(self):
+        return False
+    
+    def subscribe(self, callback):
+        """変更通知を受け取る関数を登録し、登録を解除する関数を返す"""
+        with self._listeners_lock:
+            self._listeners.append(callback)
+        
+        def unsubscribe():
+            with self._listeners_lock:
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+        return unsubscribe
+    
+    def _notify(self):
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback(self.key)
+
+class SheetVersions:
+    """ワークシート（イベント）ごとの変更確認（スプレッドシートごとに全イベントで共有）
+    
+    DriveのmodifiedTimeはどのワークシートの変更でも進むため、それだけではどのイベントが
+    変わったか分からない。modifiedTimeの確認はスプレッドシートごとに check_interval に1回だけ行い、
+    進んでいれば最近確認されたワークシートの内容を values_batch_get 1回でまとめて読み、
+    内容が変わったワークシートだけバージョンを進める。間隔内の確認は前回の結果を返す。
+    """
+    
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._modified = None
+        self._checked_at = None
+        self._titles = {}        # key -> ワークシート名
+        self._watched = {}       # key -> 最後に確認された時刻
+        self._fingerprints = {}  # key -> 内容のハッシュ
+        self._versions = {}      # key -> 内容が変わった回数
+        self._lock = threading.Lock()
+    
+    def check(self, key, sheet):
+        """key のワークシート（sheet）のバージョンを返す（通信エラーは呼び出し元に送出）"""
+        with self._lock:
+            now = time.monotonic()
+            self._titles.setdefault(key, sheet.title)
+            self._watched[key] = now
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                self._poll(sheet.spreadsheet, now)
+            return self._versions.get(key, 0)
+    
+    def _poll(self, spreadsheet, now):
+        modified = spreadsheet.get_lastUpdateTime()
+        if modified == self._modified:
+            return
+        # 確認が止まったワークシート（破棄したイベント）は読まない
+        keys = [key for key, at in self._watched.items() if now - at <= 3 * self.check_interval]
+        ranges = ["'{}'".format(self._titles[key].replace("'", "''")) for key in keys]
+        value_ranges = spreadsheet.values_batch_get(ranges).get("valueRanges", []) if keys else []
+        for key, value_range in zip(keys, value_ranges):
+            fingerprint = hash(tuple(tuple(row) for row in value_range.get("values", [])))
+            if self._fingerprints.get(key) != fingerprint:
+                self._fingerprints[key] = fingerprint
+                self._versions[key] = self._versions.get(key, 0) + 1
+        # 読み込みに失敗した場合は次回も読み直す
+        self._modified = modified
+
+@st.cache_resource
+def get_sheet_versions(spreadsheet_id):
+    """スプレッドシートごとの変更確認を取得（プロセス全体で共有）"""
+    return SheetVersions(check_interval=float(get_setting("watch_interval", 10)))
+
+class SheetsBackend(StorageBackend):
+    """Google Sheetsに保存するバックエンド（読み込みは DataCache、行の特定は RowIndex を使う）
+    
+    他の端末からの変更は versions（SheetVersions）でワークシート単位に確認する。
+    """
+    
+    def __init__(self, handle, cache, versions=None):
+        super().__init__(worksheet_key(handle.spreadsheet_id, handle.worksheet))
+        self.handle = handle
+        self.cache = cache
+        self.versions = versions or SheetVersions(check_interval=0)
+        self._version = None
+    
+    def load(self):
+        return self.handle.run(self.cache.load, self.key)
+    
+    def update_cells(self, changes):
+        conflicts = self._write(lambda sheet: write_changes(sheet, self.cache.row_index(sheet, self.key), changes))
+        return conflicts
+    
+    def append_many(self, names):
+        return self._write(lambda sheet: append_rows_data(sheet, self.cache.row_index(sheet, self.key), names))
+    
+    def delete(self, no):
+        return self._write(lambda sheet: delete_row_data(sheet, self.cache.row_index(sheet, self.key), no))
+    
+    def poll_changes(self):
+        # このワークシートの内容が変わっていれば、TTL内でもキャッシュを破棄する（他のイベントの変更では破棄しない）
+        version = self.handle.run(lambda sheet: self.versions.check(self.key, sheet))
+        changed = self._version is not None and version != self._version
+        self._version = version
+        if changed:
+            self.cache.invalidate(self.key)
+        return changed
+    
+    def _write(self, fn):
+        try:
+            result = self.handle.run(fn)
+        except Exception as e:
+            # 接続できなかった場合は書き込まれていないため、表示中の内容（キャッシュ）を残す
+            if not is_connection_error(e):
+                # それ以外の失敗は途中まで書き込まれている可能性があるため、キャッシュは破棄する
+                self.cache.invalidate(self.key)
+                self._notify()
+            raise
+        self.cache.invalidate(self.key)
+        self._notify()
+        return result
+
+class SQLiteBackend(StorageBackend):
+    """ローカルのSQLiteに保存するバックエンド（WALモード、Noを主キーとして索引）
+    
+    ネットワーク往復がないため、Google Sheetsのレート制限を受けずにディスクの速度で読み書きできる。
+    オフラインでの動作確認にも使える。
+    """
+    
+    def __init__(self, path):
+        super().__init__(f"sqlite:{path}")
+        self.path = path
+        self._mtime = None
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS attendees ('
+                '"No" INTEGER PRIMARY KEY, "名前" TEXT NOT NULL, "1次会" TEXT NOT NULL DEFAULT \'\', '
+                '"2次会" TEXT NOT NULL DEFAULT \'\', "コメント" TEXT NOT NULL DEFAULT \'\', '
+                '"更新日時" TEXT NOT NULL DEFAULT \'\')'
+            )
+    
+    def load(self):
+        with self._connect() as conn:
+            df = pd.read_sql_query('SELECT * FROM attendees ORDER BY "No"', conn)
+        return compact_roster(df)
+    
+    def update_cells(self, changes):
+        if not changes:
+            return []
+        
+        nos = list({int(no) for no, _, _, _ in changes})
+        with self._connect() as conn:
+            # 読み直しから書き込みまでを1つの書き込みトランザクションで行う
+            conn.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" * len(nos))
+            rows = conn.execute(f'SELECT * FROM attendees WHERE "No" IN ({placeholders})', nos).fetchall()
+            current = {str(row[0]): [str(v) for v in row] for row in rows}
+            writes, conflicts = merge_changes(current, changes)
+            for no, col, value in writes:
+                conn.execute(f'UPDATE attendees SET "{col}" = ? WHERE "No" = ?', (str(value), int(no)))
+            conn.execute("COMMIT")
+        self._notify()
+        return conflicts
+    
+    def append_many(self, names):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            first_no = conn.execute('SELECT COALESCE(MAX("No"), 0) + 1 FROM attendees').fetchone()[0]
+            new_nos = list(range(first_no, first_no + len(names)))
+            conn.executemany('INSERT INTO attendees ("No", "名前") VALUES (?, ?)', zip(new_nos, names))
+            conn.execute("COMMIT")
+        self._notify()
+        return new_nos
+    
+    def delete(self, no):
+        with self._connect() as conn:
+            deleted = conn.execute('DELETE FROM attendees WHERE "No" = ?', (int(no),)).rowcount > 0
+        self._notify()
+        return deleted
+    
+    def poll_changes(self):
+        # 他のプロセスからの書き込みは、データベースとWALファイルの更新時刻で検知する
+        mtime = max(os.path.getmtime(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+        changed = self._mtime is not None and mtime != self._mtime
+        self._mtime = mtime
+        return changed
+    
+    def _connect(self):
+        # 接続はスレッドをまたがないよう操作ごとに開く（autocommit、トランザクションは明示的に開始）
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return closing(conn)
+
+@st.cache_resource
+def get_sheets_backend(spreadsheet_id, worksheet=None):
+    """ワークシート（イベント）ごとのバックエンドを取得（プロセス全体で共有）"""
+    return SheetsBackend(get_worksheet_handle(spreadsheet_id, worksheet), get_data_cache(), get_sheet_versions(spreadsheet_id))
+
+@st.cache_resource
+def get_sqlite_backend(path):
+    """SQLiteファイルごとのバックエンドを取得（プロセス全体で共有）"""
+    return SQLiteBackend(path)
+
+class CheckinJournal:
+    """書き込みキューに渡した変更を、送信が終わるまでローカルのSQLiteに残す追記型の記録
+    
+    変更は1件ごとにコミット（synchronous=FULL）してから受け付けるため、サーバーが落ちても
+    未送信の変更は失われない。op_id は No・セッション・時刻から作る操作ごとのIDで、
+    同じ操作を2回記録しない。送信に成功した変更は削除する。
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, op_id TEXT NOT NULL UNIQUE, "
+                "backend_key TEXT NOT NULL, no INTEGER NOT NULL, "
+                "changes TEXT NOT NULL, base TEXT NOT NULL, created_at TEXT NOT NULL)"
+            )
+    
+    def append(self, backend_key, op_id, no, values, base):
+        """変更を記録して通し番号を返す（同じ op_id が記録済みならNone）"""
+        return self.append_many(backend_key, [(op_id, no, values, base)])[0]
+    
+    def append_many(self, backend_key, ops):
+        """変更 (op_id, No, {列名: 値}, {列名: 元の値}) を1つのトランザクションで記録し、通し番号のリストを返す"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        seqs = []
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for op_id, no, values, base in ops:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO journal (op_id, backend_key, no, changes, base, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (op_id, backend_key, int(no), json.dumps(values, ensure_ascii=False),
+                     json.dumps(base, ensure_ascii=False), now),
+                )
+                seqs.append(cursor.lastrowid if cursor.rowcount else None)
+            conn.execute("COMMIT")
+        return seqs
+    
+    def pending(self, backend_key):
+        """未送信の変更 (通し番号, No, {列名: 値}, {列名: 元の値}) を記録した順に返す"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, no, changes, base FROM journal WHERE backend_key = ? ORDER BY seq", (backend_key,)
+            ).fetchall()
+        return [(seq, no, json.loads(values), json.loads(base)) for seq, no, values, base in rows]
+    
+    def remove(self, seqs):
+        """送信した変更を削除"""
+        if not seqs:
+            return
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM journal WHERE seq IN ({','.join('?' * len(seqs))})", list(seqs))
+    
+    def _connect(self):
+        # 受け付けた変更を失わないよう、コミットごとにディスクへ書き出す
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA synchronous=FULL")
+        return closing(conn)
+
+@st.cache_resource
+def get_checkin_journal(path):
+    """未送信の変更の記録を取得（プロセス全体で共有）"""
+    return CheckinJournal(path)
+
+def open_journal():
+    """オフラインモード（offline_mode）なら未送信の変更の記録を返す。無効ならNone"""
+    if not get_setting("offline_mode", False):
+        return None
+    return get_checkin_journal(get_setting("journal_path", "checkin_journal.db"))
+
+def load_data(backend):
+    """バックエンドからデータを読み込む"""
+    try:
+        return backend.load()
+    except Exception as e:
+        if is_retryable_error(e):
+            st.warning("⏳ Google Sheetsが混み合っています。しばらくしてから「最新データを取得」を押してください")
+        elif is_connection_error(e):
+            st.warning("📴 Google Sheetsに接続できません。接続が戻ってから「最新データを取得」を押してください")
+        else:
+            st.error(f"データ読み込みエラー: {e}")
+        return compact_roster(pd.DataFrame(columns=COLUMNS))
+
+def add_participant(backend, name):
+    """参加者を追加し、割り当てたNoを返す。失敗時はNone"""
+    try:
+        return backend.append(name)
+    except Exception as e:
+        st.error(f"データ保存エラー: {e}")
+        return None
+
+def name_key(name):
+    """重複の判定に使う名前（全角・半角と空白の違いを無視）"""
+    return "".join(unicodedata.normalize("NFKC", str(name)).split())
+
+def csv_rows(file, encoding):
+    """CSVファイルを1行ずつ読む（ファイル全体を文字列にしない）"""
+    text = io.TextIOWrapper(file, encoding=encoding, newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+def xlsx_rows(file):
+    """Excelファイルの最初のシートを1行ずつ読む（read_only で行ごとに読み込む）"""
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ["" if v is None else str(v) for v in row]
+    finally:
+        workbook.close()
+
+def import_names(rows, existing):
+    """行の並びから追加する名前を取り出す
+    
+    1行目に「名前」列があればその列を、なければ1列目を名前とみなす。空欄と、existing
+    （登録済みの名前の name_key の集合）やそれまでの行と重複する名前は飛ばす。
+    (追加する名前のリスト, 飛ばした重複の件数) を返す。
+    """
+    names, seen, skipped = [], set(existing), 0
+    column = 0
+    for i, row in enumerate(rows):
+        if i == 0 and "名前" in (cell.strip() for cell in row):
+            column = [cell.strip() for cell in row].index("名前")
+            continue
+        name = row[column].strip() if len(row) > column else ""
+        if not name:
+            continue
+        key = name_key(name)
+        if key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        names.append(name)
+    return names, skipped
+
+def read_import_file(file, existing):
+    """アップロードされたCSV / Excelファイルから追加する名前を読む（import_names と同じ値を返す）"""
+    if file.name.lower().endswith(".xlsx"):
+        return import_names(xlsx_rows(file), existing)
+    # Excelで保存したCSVはShift_JIS（cp932）のことが多いため、UTF-8で読めなければ読み直す
+    try:
+        return import_names(csv_rows(file, "utf-8-sig"), existing)
+    except UnicodeDecodeError:
+        file.seek(0)
+        return import_names(csv_rows(file, "cp932"), existing)
+
+def add_participants(backend, names):
+    """参加者をまとめて追加し、割り当てたNoのリストを返す。失敗時はNone"""
+    try:
+        return backend.append_many(names)
+    except Exception as e:
+        st.error(f"データ保存エラー: {e}")
+        return None
+
+def delete_participant(backend, no):
+    """Noの参加者を削除"""
+    try:
+        deleted = backend.delete(no)
+        if not deleted:
+            st.warning("⚠️ 既に削除されています")
+        return deleted
     except Exception as e:
         st.error(f"データ保存エラー: {e}")
         return False
 
-def main():
-    # タイトル
-    st.markdown('<div class="header-style"><h1>📝 出席簿アプリ</h1><p>参加者の出席状況を管理</p></div>', unsafe_allow_html=True)
+class WriteBehindQueue:
+    """出欠の変更をバックグラウンドでまとめて書き込むキュー（保存先ごとに共有）
+    
+    submit された変更は (No, 列名) 単位で上書き集約され、flush_interval 待ってから
+    1回の update_cells で書き込まれる。書き込みに失敗した変更は再試行キューに移し、
+    間隔を空けて再送する。画面には apply_pending で未保存の変更を重ねて表示する。
+    元の値は最初に submit された時点のものを保持し、書き込み時の競合検出に使う。
+    subscribe で登録した関数は、submit のたびに (No, {列名: 値}) を引数に呼ばれる。
+    journal（CheckinJournal）を渡すと、submit した変更は記録してから受け付け、書き込みに
+    成功するまで残す。作成時に前回送信できなかった変更を記録した順に読み込み、再送する。
+    close は未送信の変更がなければスレッドを止める（止めた後に submit されたら再開する）。
+    """
+    
+    def __init__(self, backend, flush_interval, journal=None):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self.last_error = None
+        self.revision = 0    # submit のたびに増える番号（表示の再計算の判定に使う）
+        self._pending = {}   # 未送信の変更 (No, 列名) -> 値
+        self._inflight = {}  # 送信中の変更
+        self._retry = {}     # 送信に失敗した変更
+        self._base = {}      # 編集を始めた時点の値 (No, 列名) -> 元の値
+        self._seqs = {"pending": [], "inflight": [], "retry": []}  # 各変更の記録の通し番号
+        self._conflicts = []
+        self._failures = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        if journal is not None:
+            # 前回送信できなかった変更を記録した順に積み直す
+            for seq, no, values, base in journal.pending(backend.key):
+                self._enqueue(no, values, base, seq)
+            self._wakeup.set()
+        self._start()
+    
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.backend.key}", daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        """未送信の変更がなければスレッドを止めてTrueを返す。あれば直ちに送信を始めてFalseを返す"""
+        with self._lock:
+            if self._pending or self._inflight or self._retry:
+                self._wakeup.set()
+                return False
+            self._closed = True
+        self._wakeup.set()
+        return True
     
-    # ダイアログ関数の定義
-    @st.dialog("出欠を選択してください")
-    def select_attendance(meeting_type, person_no, person_name, idx, df):
-        st.markdown(f"### {person_name}さんの{meeting_type}出欠")
+    def submit(self, no, values, base, op_id=None):
+        """1人分の変更 {列名: 値} を、編集前の値 {列名: 元の値} とともにキューに追加
         
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("✓ 出席", key=f"dialog_attend_{meeting_type}_{person_no}", type="primary", use_container_width=True):
-                df.at[idx, meeting_type] = "出席"
-                df.at[idx, "更新日時"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                st.session_state['attendance_changed'] = True
-                st.session_state['updated_df'] = df
-                st.rerun()
-        with col2:
-            if st.button("✗ 欠席", key=f"dialog_absent_{meeting_type}_{person_no}", use_container_width=True):
-                df.at[idx, meeting_type] = "欠席"
-                df.at[idx, "更新日時"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                st.session_state['attendance_changed'] = True
-                st.session_state['updated_df'] = df
+        op_id は操作ごとのID（省略時は作成する）。記録済みの op_id の変更は無視する。
+        """
+        self.submit_many([(no, values, base, op_id)])
+    
+    def submit_many(self, items):
+        """複数人分の変更 (No, {列名: 値}, {列名: 元の値}, op_id) をまとめてキューに追加
+        
+        まとめて追加した変更は同じ書き込み（1回の update_cells）に入る。
+        """
+        seqs = [None] * len(items)
+        if self.journal is not None:
+            seqs = self.journal.append_many(self.backend.key, [
+                (op_id or f"{no}:{self.backend.key}:{time.time_ns()}", no, values, base)
+                for no, values, base, op_id in items
+            ])
+            # 記録済みの変更は受け付け済みのため飛ばす
+            items = [item for item, seq in zip(items, seqs) if seq is not None]
+            seqs = [seq for seq in seqs if seq is not None]
+        if not items:
+            return
+        with self._lock:
+            for (no, values, base, _), seq in zip(items, seqs):
+                self._enqueue(no, values, base, seq)
+            self.revision += 1
+            listeners = list(self._listeners)
+            if self._closed:
+                # 止めた後に届いた変更も送れるよう、スレッドを再開する
+                self._closed = False
+                self._start()
+        self._wakeup.set()
+        for no, values, _, _ in items:
+            for callback in listeners:
+                callback(no, values)
+    
+    def _enqueue(self, no, values, base, seq):
+        for col, value in values.items():
+            self._pending[(no, col)] = value
+            self._base.setdefault((no, col), base.get(col))
+        if seq is not None:
+            self._seqs["pending"].append(seq)
+    
+    def subscribe(self, callback):
+        """submit された変更を受け取る関数を登録"""
+        with self._lock:
+            self._listeners.append(callback)
+    
+    def apply_pending(self, df):
+        """未保存の変更をDataFrameに重ねる（楽観的表示）"""
+        with self._lock:
+            overlay = {**self._retry, **self._inflight, **self._pending}
+        if not overlay:
+            return df
+        
+        df = df.copy(deep=False)
+        for (no, col), value in overlay.items():
+            df.loc[df["No"] == no, col] = value
+        return df
+    
+    def pending_values(self, no):
+        """1人分の未保存の変更 {列名: 値} を返す（行単位の表示用）"""
+        with self._lock:
+            overlay = {**self._retry, **self._inflight, **self._pending}
+        return {col: value for (key_no, col), value in overlay.items() if key_no == no}
+    
+    def status(self):
+        """(保存待ちの件数, 再試行待ちの件数, 最後のエラー) を返す"""
+        with self._lock:
+            waiting = len(self._pending.keys() | self._inflight.keys())
+            return waiting, len(self._retry), self.last_error
+    
+    def conflicts(self):
+        """他の端末の変更と競合して反映しなかった変更 (No, 列名, 値, 他の端末の値) のリスト"""
+        with self._lock:
+            return list(self._conflicts)
+    
+    def clear_conflicts(self):
+        with self._lock:
+            self._conflicts = []
+    
+    def retry_now(self):
+        """再試行待ちの変更を直ちに再送する"""
+        self._wakeup.set()
+    
+    def _run(self):
+        delay = None
+        while True:
+            self._wakeup.wait(delay)
+            with self._lock:
+                if self._closed:
+                    return
+            # 続けて押された変更を1回の書き込みにまとめるため少し待つ
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            # 失敗した場合は間隔を延ばしながら再試行する
+            delay = None if self._flush() else min(2 ** self._failures, 60)
+    
+    def _flush(self):
+        with self._lock:
+            batch = {**self._retry, **self._pending}
+            self._inflight = batch
+            self._retry = {}
+            self._pending = {}
+            seqs = self._seqs["retry"] + self._seqs["pending"]
+            self._seqs = {"pending": [], "inflight": seqs, "retry": []}
+        if not batch:
+            return True
+        
+        with self._lock:
+            changes = [(no, col, value, self._base.get((no, col))) for (no, col), value in batch.items()]
+        try:
+            conflicts = self.backend.update_cells(changes)
+        except Exception as e:
+            with self._lock:
+                # 送信中に同じセルへ新しい変更があればそちらを優先する
+                for key, value in batch.items():
+                    if key not in self._pending:
+                        self._retry[key] = value
+                self._inflight = {}
+                self._seqs["retry"], self._seqs["inflight"] = seqs, []
+                self._failures += 1
+                self.last_error = e
+            return False
+        
+        with self._lock:
+            for key, value in batch.items():
+                if key in self._pending:
+                    # 送信中に追加された変更は、今回書き込んだ値を元の値として扱う
+                    self._base[key] = value
+                else:
+                    self._base.pop(key, None)
+            self._conflicts.extend(conflicts)
+            self._inflight = {}
+            self._seqs["inflight"] = []
+            self._failures = 0
+            self.last_error = None
+        if self.journal is not None:
+            self.journal.remove(seqs)
+        return True
+
+def get_write_queue(key, backend):
+    """保存先ごとの書き込みキューを取得（プロセス全体で共有、使われなくなったら EventResources が止める）"""
+    def create():
+        # ローカルのSQLiteと複製への書き込みはその場で終わる（複製から上流への送信は複製側で記録する）
+        journal = None if isinstance(backend, (SQLiteBackend, ReplicaBackend)) else open_journal()
+        return WriteBehindQueue(backend, flush_interval=float(get_setting("write_behind_interval", 1.0)), journal=journal)
+    return get_event_resources().get(key, "queue", create)
+
+class ReplicaBackend(StorageBackend):
+    """全セッションが読み書きするメモリ上の複製と、Google Sheetsとのバックグラウンド同期
+    
+    読み込みはメモリ上の複製を返すだけで、書き込みは複製に即時反映してから push_queue に渡す。
+    push_queue は変更を集約して sync_interval ごとに上流へ送り、更新日時による競合検出は
+    上流の update_cells が行う。別スレッドで sync_interval ごとに上流を読み込み、
+    未送信の変更を重ねた上で複製を置き換える。Sheets APIの呼び出し回数は接続中の端末数によらない。
+    idle_timeout 秒読まれず未送信の変更もなければ複製を破棄し、次に読まれるまで同期を止める。
+    journal を渡すと上流へ未送信の変更を記録し、接続が切れている間や再起動後も記録した順に送る。
+    """
+    
+    def __init__(self, upstream, sync_interval, idle_timeout=None, journal=None):
+        super().__init__(f"replica:{upstream.key}")
+        self.upstream = upstream
+        self.sync_interval = sync_interval
+        self.idle_timeout = idle_timeout
+        self.push_queue = WriteBehindQueue(upstream, flush_interval=sync_interval, journal=journal)
+        self.synced_at = None
+        self.last_error = None
+        self._df = None
+        self._read_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._upstream_writes = 0
+        upstream.subscribe(self._on_upstream_write)
+        self._thread = threading.Thread(target=self._run, name=f"replica-sync-{upstream.key}", daemon=True)
+        self._thread.start()
+    
+    def load(self):
+        with self._lock:
+            self._read_at = time.monotonic()
+            if self._df is None:
+                self._df = self.push_queue.apply_pending(self.upstream.load())
+                self.synced_at = datetime.now()
+            return self._df.copy(deep=False)
+    
+    def update_cells(self, changes):
+        self.load()
+        with self._lock:
+            df = self._df
+            current = {str(cells[0]): [str(v) for v in cells] for cells in wire_rows(df)}
+            writes, conflicts = merge_changes(current, changes)
+            
+            # 上流へは、複製に反映する前の値を元の値として送る
+            by_person = {}
+            for no, col, value in writes:
+                values, base = by_person.setdefault(no, ({}, {}))
+                values[col] = value
+                base[col] = current[str(no)][COLUMNS.index(col)]
+                df.loc[df["No"] == no, col] = value
+            self.push_queue.submit_many([(no, values, base, None) for no, (values, base) in by_person.items()])
+        if writes:
+            self._notify()
+        return conflicts
+    
+    def append_many(self, names):
+        # 追加・削除は頻度が低いため、上流に直接書き込んでから複製に反映する
+        new_nos = self.upstream.append_many(names)
+        self._add_rows(new_nos, names)
+        self._notify()
+        return new_nos
+    
+    def _add_rows(self, nos, names):
+        """上流に追加した行を複製に反映する"""
+        self.load()
+        with self._lock:
+            if self._df is None:
+                return
+            # 複製をまだ読んでいなかった場合（破棄後を含む）は、上流の読み込みに追加した行が含まれている
+            present = set(self._df["No"].tolist())
+            rows = [(no, name) for no, name in zip(nos, names) if no not in present]
+            if rows:
+                new_rows = compact_roster(pd.DataFrame({
+                    "No": [no for no, _ in rows], "名前": [name for _, name in rows],
+                    "1次会": "", "2次会": "", "コメント": "", "更新日時": "",
+                }))
+                self._df = pd.concat([self._df, new_rows], ignore_index=True)
+    
+    def delete(self, no):
+        deleted = self.upstream.delete(no)
+        self.load()
+        with self._lock:
+            self._df = self._df[self._df["No"] != no].reset_index(drop=True)
+        self._notify()
+        return deleted
+    
+    def _on_upstream_write(self, key):
+        with self._lock:
+            self._upstream_writes += 1
+    
+    def _run(self):
+        while True:
+            time.sleep(self.sync_interval)
+            self._pull()
+    
+    def _pull(self):
+        """上流を読み込み、未送信の変更を重ねて複製を置き換える"""
+        with self._lock:
+            if self._df is None:
+                # まだ読まれていない（または破棄した）複製は同期しない
+                return
+            waiting, failed, _ = self.push_queue.status()
+            if self.idle_timeout is not None and time.monotonic() - self._read_at > self.idle_timeout and not waiting and not failed:
+                self._df = None
+                return
+            writes = self._upstream_writes
+        try:
+            remote = self.upstream.load()
+        except Exception as e:
+            self.last_error = e
+            return
+        
+        with self._lock:
+            # 読み込み中に上流へ書き込んだ場合は、書き込み前の内容の可能性があるため次回に持ち越す
+            if writes != self._upstream_writes:
+                return
+            remote = self.push_queue.apply_pending(remote)
+            changed = self._df is None or not remote.equals(self._df)
+            self._df = remote
+            self.synced_at = datetime.now()
+            self.last_error = None
+        if changed:
+            self._notify()
+
+@st.cache_resource
+def get_replica_backend(spreadsheet_id, worksheet=None):
+    """ワークシート（イベント）ごとの複製を取得（プロセス全体で共有）"""
+    # 同期での読み込みは毎回変更の有無を確認するため、キャッシュのTTLは0にする
+    upstream = SheetsBackend(get_worksheet_handle(spreadsheet_id, worksheet), DataCache(ttl=0, auto_migrate=bool(get_setting("auto_migrate", True))))
+    return ReplicaBackend(
+        upstream,
+        sync_interval=float(get_setting("sync_interval", 5)),
+        idle_timeout=float(get_setting("event_idle_timeout", 600)),
+        journal=open_journal(),
+    )
+
+class ChangeNotifier:
+    """保存先ごとの変更通知（バージョン番号）
+    
+    このプロセスからの書き込みは subscribe で即時に、他のプロセスや端末からの変更は
+    watch_interval ごとの poll_changes で検知してバージョンを進める。確認はプロセスで
+    1つのスレッドだけが行うため、APIの呼び出し回数は接続中のセッション数によらない。
+    close で登録を解除し、スレッドを止める。
+    """
+    
+    def __init__(self, backend, watch_interval):
+        self.backend = backend
+        self.watch_interval = watch_interval
+        self.version = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._unsubscribe = backend.subscribe(self._bump)
+        self._thread = threading.Thread(target=self._run, name=f"change-watch-{backend.key}", daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        self._unsubscribe()
+        self._stopped.set()
+        return True
+    
+    def _bump(self, key=None):
+        with self._lock:
+            self.version += 1
+    
+    def _run(self):
+        while not self._stopped.wait(self.watch_interval):
+            try:
+                if self.backend.poll_changes():
+                    self._bump()
+            except Exception:
+                # 一時的な通信エラーは次回の確認に任せる
+                pass
+
+def get_change_notifier(key, backend):
+    """保存先ごとの変更通知を取得（プロセス全体で共有、使われなくなったら EventResources が止める）"""
+    return get_event_resources().get(key, "notifier", lambda: ChangeNotifier(backend, watch_interval=float(get_setting("watch_interval", 10))))
+
+class EventResources:
+    """イベント（保存先）ごとに共有するオブジェクト（書き込みキュー・変更通知・集計・並び順）
+    
+    DataCache と同じく、idle_timeout 秒使われていないイベントと、max_entries を超えた分
+    （使われた時刻の古い順）を破棄する。破棄する前に close を持つものは close を呼んで
+    スレッドを止める。書き込みキューは未送信の変更を送り終えるまで破棄しない。
+    使われていないイベントはバックグラウンドのスレッドが定期的に破棄する。
+    """
+    
+    def __init__(self, max_entries=None, idle_timeout=None):
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self._entries = {}  # key -> {種類: オブジェクト}
+        self._used = {}     # key -> 最後に使われた時刻
+        self._lock = threading.Lock()
+        if idle_timeout is not None:
+            self._thread = threading.Thread(target=self._run, name="event-resources-evict", daemon=True)
+            self._thread.start()
+    
+    def get(self, key, kind, create):
+        """key のイベントの kind のオブジェクトを返す（なければ create() で作る）"""
+        with self._lock:
+            self._used[key] = time.monotonic()
+            resources = self._entries.setdefault(key, {})
+            if kind not in resources:
+                resources[kind] = create()
+            self._evict(keep=key)
+            return resources[kind]
+    
+    def _run(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            with self._lock:
+                self._evict()
+    
+    def _evict(self, keep=None):
+        now = time.monotonic()
+        keys = sorted((key for key in self._entries if key != keep), key=lambda key: self._used.get(key, 0))
+        excess = max(len(self._entries) - self.max_entries, 0) if self.max_entries is not None else 0
+        for i, key in enumerate(keys):
+            idle = self.idle_timeout is not None and now - self._used.get(key, 0) > self.idle_timeout
+            if not idle and i >= excess:
+                continue
+            # 書き込みキューを先に閉じ、送信待ちが残っていれば次回に持ち越す
+            resources = self._entries[key]
+            if not all(resources[kind].close() for kind in sorted(resources, key=lambda kind: kind != "queue") if hasattr(resources[kind], "close")):
+                continue
+            del self._entries[key]
+            self._used.pop(key, None)
+
+@st.cache_resource
+def get_event_resources():
+    """プロセス全体で共有するイベントごとのオブジェクトの置き場を取得"""
+    return EventResources(
+        max_entries=int(get_setting("event_cache_size", 4)),
+        idle_timeout=float(get_setting("event_idle_timeout", 600)),
+    )
+
+# 集計で使う出欠の区分（配列上のコード順）
+ATTENDANCE_CODES = ["未回答", "出席", "欠席"]
+
+def attendance_codes(values):
+    """出欠の列を 0=未回答 / 1=出席 / 2=欠席 のコード配列に変換"""
+    values = np.asarray(values, dtype=object)
+    return np.where(values == "出席", 1, np.where(values == "欠席", 2, 0)).astype(np.int8)
+
+class AttendanceStats:
+    """出欠の集計（保存先ごとに共有し、データのバージョンごとに1回だけ集計する）
+    
+    1次会と2次会のコードの組み合わせごとの人数を3×3の表で持ち、出席・欠席・未回答の人数、
+    両方・どちらか・どちらも出席していない人数、回答率はすべてこの表から求める。
+    バージョンが変わった時だけ全件を1回のnp.bincountで数え直し、それ以外の変更は
+    書き込みキューへの submit を受けて、その人の組み合わせを1つ移すだけで反映する。
+    """
+    
+    MEETINGS = ["1次会", "2次会"]
+    
+    def __init__(self, queue):
+        self.version = None
+        self._codes = np.zeros((0, 2), dtype=np.int8)  # 参加者ごとの (1次会, 2次会) のコード
+        self._positions = {}  # No -> _codes の行
+        self._matrix = np.zeros((3, 3), dtype=np.int64)
+        self._lock = threading.Lock()
+        queue.subscribe(self._on_submit)
+    
+    def current(self, version, load):
+        """version の集計を返す（未集計なら load() で読み込んだDataFrameから集計する）"""
+        with self._lock:
+            if self.version != version:
+                self._rebuild(load())
+                self.version = version
+            return self._summary()
+    
+    def _rebuild(self, df):
+        codes = np.column_stack([attendance_codes(df[meeting]) for meeting in self.MEETINGS]) if len(df) else np.zeros((0, 2), dtype=np.int8)
+        self._codes = codes
+        self._positions = {str(no): i for i, no in enumerate(df["No"])}
+        self._matrix = np.bincount(codes[:, 0] * 3 + codes[:, 1], minlength=9).reshape(3, 3)
+    
+    def _on_submit(self, no, values):
+        with self._lock:
+            position = self._positions.get(str(no))
+            if position is None:
+                # 集計にない行の変更は、次のバージョンの再集計で反映する
+                return
+            old = tuple(self._codes[position])
+            for i, meeting in enumerate(self.MEETINGS):
+                if meeting in values:
+                    self._codes[position, i] = attendance_codes([values[meeting]])[0]
+            new = tuple(self._codes[position])
+            self._matrix[old] -= 1
+            self._matrix[new] += 1
+    
+    def _summary(self):
+        matrix = self._matrix
+        total = int(matrix.sum())
+        summary = {"総参加者数": total}
+        for meeting, counts in zip(self.MEETINGS, [matrix.sum(axis=1), matrix.sum(axis=0)]):
+            breakdown = dict(zip(ATTENDANCE_CODES, (int(c) for c in counts)))
+            breakdown["回答率"] = (breakdown["出席"] + breakdown["欠席"]) / total if total else 0.0
+            summary[meeting] = breakdown
+        summary["両方出席"] = int(matrix[1, 1])
+        summary["どちらか出席"] = int(matrix[1, :].sum() + matrix[:, 1].sum() - matrix[1, 1])
+        summary["どちらも不参加"] = total - summary["どちらか出席"]
+        return summary
+
+def get_attendance_stats(key, queue):
+    """保存先ごとの出欠の集計を取得（プロセス全体で共有、書き込みキューと一緒に破棄する）"""
+    return get_event_resources().get(key, "stats", lambda: AttendanceStats(queue))
+
+# 表示順序の選択肢
+SORT_OPTIONS = ["No順", "名前順（あいうえお）", "1次会出席者優先", "2次会出席者優先"]
+
+_kakasi = pykakasi.kakasi() if pykakasi is not None else None
+
+@lru_cache(maxsize=None)
+def name_reading(name):
+    """名前順に使う読み（ひらがな）。pykakasi がない場合、漢字は文字コード順のまま並ぶ"""
+    name = unicodedata.normalize("NFKC", str(name))
+    if _kakasi is not None:
+        name = "".join(item["hira"] for item in _kakasi.convert(name))
+    # カタカナをひらがなに揃える（ァ〜ヶ → ぁ〜ゖ）
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in name)
+
+class SortOrders:
+    """表示順序ごとの並び順（保存先ごとに共有し、データのバージョンごとに1回だけ計算する）
+    
+    並び替えのキー（Noの数値、読み仮名、出欠の順序付きカテゴリのコード）はバージョンが変わった時に
+    まとめて作り、各表示順序の並び順は行位置の配列として保持する。同じバージョンの間は、
+    表示順序の切り替えや再実行でも並び替え直さない。
+    """
+    
+    def __init__(self):
+        self._version = None
+        self._nos = None
+        self._keys = {}
+        self._orders = {}
+        self._lock = threading.Lock()
+    
+    def order(self, df, version, sort_option):
+        """df の行位置を sort_option の順に並べた配列を返す"""
+        with self._lock:
+            nos = df["No"].to_numpy()
+            # 同じバージョンでも読み込んだ行が違えば作り直す
+            if self._version != version or not np.array_equal(self._nos, nos):
+                self._version = version
+                self._nos = nos
+                self._keys = self._sort_keys(df)
+                self._orders = {}
+            if sort_option not in self._orders:
+                self._orders[sort_option] = self._sort(sort_option)
+            return self._orders[sort_option]
+    
+    @staticmethod
+    def _sort_keys(df):
+        return {
+            "No": pd.to_numeric(df["No"], errors="coerce").to_numpy(),
+            "読み": df["名前"].map(name_reading).to_numpy(dtype=str),
+            "名前": df["名前"].astype(str).to_numpy(dtype=str),
+            # 出欠は順序付きカテゴリ（出席 < 欠席 < 未選択）のコード
+            "1次会": df["1次会"].astype(ATTENDANCE_DTYPE).cat.codes.to_numpy(),
+            "2次会": df["2次会"].astype(ATTENDANCE_DTYPE).cat.codes.to_numpy(),
+        }
+    
+    def _sort(self, sort_option):
+        keys = self._keys
+        # np.lexsort は最後のキーが最優先
+        if sort_option == "名前順（あいうえお）":
+            return np.lexsort((keys["No"], keys["名前"], keys["読み"]))
+        if sort_option == "1次会出席者優先":
+            return np.lexsort((keys["No"], keys["1次会"]))
+        if sort_option == "2次会出席者優先":
+            return np.lexsort((keys["No"], keys["2次会"]))
+        return np.argsort(keys["No"], kind="stable")
+
+def get_sort_orders(key):
+    """保存先ごとの並び順を取得（プロセス全体で共有、変更通知と一緒に破棄する）"""
+    return get_event_resources().get(key, "sort_orders", SortOrders)
+
+def rerun_fragment():
+    """実行中のフラグメントだけを再実行する（全体の再実行中に呼ばれた場合は全体を再実行）"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def render_write_status(queue, key):
+    """書き込みキューの保存待ち・失敗・競合を表示（サイドバーのフラグメント内で呼ぶ）"""
+    waiting, failed, last_error = queue.status()
+    if failed:
+        st.warning(f"⚠️ 保存に失敗した変更が{failed}件あります（自動で再試行します）: {last_error}")
+        if queue.journal is not None:
+            st.caption("📴 未送信の変更はこの端末に保存済みです。接続が戻ると記録した順に送信します")
+        if st.button("今すぐ再試行", key=f"{key}_retry", use_container_width=True):
+            queue.retry_now()
+            rerun_fragment()
+    elif waiting:
+        st.caption(f"⏳ 保存待ちの変更: {waiting}件")
+    
+    conflicts = queue.conflicts()
+    if conflicts:
+        lines = "\n".join(f"- No.{no} {col}: 「{value}」→ 他の端末の「{theirs}」を優先" for no, col, value, theirs in conflicts)
+        st.warning(f"⚠️ 他の端末の変更と競合したため、{len(conflicts)}件の変更は反映しませんでした\n{lines}")
+        if st.button("確認しました", key=f"{key}_conflicts", use_container_width=True):
+            queue.clear_conflicts()
+            rerun_fragment()
+
+# 1ページに表示する人数の選択肢
+PAGE_SIZES = [20, 50, 100, 200]
+
+def request_jump():
+    """名前検索の入力時に、該当者のページへ移動するよう予約する"""
+    st.session_state['jump_pending'] = True
+
+def find_page(df, query, page_size):
+    """名前に query を含む最初の参加者が載っているページ番号（1始まり）を返す。見つからなければNone"""
+    matches = np.flatnonzero(df["名前"].astype(str).str.contains(query, regex=False).to_numpy())
+    if len(matches) == 0:
+        return None
+    return int(matches[0]) // page_size + 1
+
+# 一括操作の種類（表示名 -> 操作）
+BULK_ACTIONS = {
+    "✅ 出席にする": "出席",
+    "❌ 欠席にする": "欠席",
+    "↩️ 未回答に戻す": "",
+    "📋 1次会の出欠を2次会にコピー": "copy",
+}
+
+def bulk_action_changes(df, nos, action, meeting_type):
+    """一括操作の変更を (No, {列名: 値}, {列名: 元の値}) のリストで返す（値が変わらない人は含めない）
+    
+    action は BULK_ACTIONS の値。"copy" は1次会の出欠を2次会に写し、meeting_type は使わない。
+    元の値は df（画面に表示した内容）から取り、書き込み時に他の端末の変更との競合を確認する。
+    """
+    if action not in BULK_ACTIONS.values():
+        raise ValueError(f"不明な一括操作: {action!r}")
+    if action != "copy" and meeting_type not in AttendanceStats.MEETINGS:
+        raise ValueError(f"不明な対象: {meeting_type!r}")
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = df[df["No"].isin(nos)]
+    changes = []
+    for no, first, second, updated_at in zip(rows["No"], rows["1次会"].astype(str), rows["2次会"].astype(str), rows["更新日時"]):
+        col, current = ("2次会", second) if action == "copy" or meeting_type == "2次会" else ("1次会", first)
+        value = first if action == "copy" else action
+        if value == current:
+            continue
+        changes.append((int(no), {col: value, "更新日時": now}, {col: current, "更新日時": updated_at}))
+    return changes
+
+@st.fragment
+def render_bulk_actions(df, backend, query):
+    """複数の参加者の出欠をまとめて変更（選択中はこのフラグメントだけを再実行する）"""
+    queue = get_write_queue(backend.key, backend)
+    with st.expander("☑️ まとめて出欠を変更"):
+        names = dict(zip(df["No"].astype(int).tolist(), df["名前"].astype(str).tolist()))
+        targets = st.multiselect("参加者を選択", list(names), format_func=lambda no: f"No.{no} {names.get(no, '')}", key="bulk_targets")
+        if query and st.checkbox(f"「{query}」に一致する全員を対象にする", key="bulk_use_search"):
+            targets = df.loc[df["名前"].astype(str).str.contains(query, regex=False), "No"].astype(int).tolist()
+        meeting_type = st.radio("対象", AttendanceStats.MEETINGS, horizontal=True, key="bulk_meeting_type")
+        
+        columns = st.columns(len(BULK_ACTIONS))
+        for column, (label, action) in zip(columns, BULK_ACTIONS.items()):
+            with column:
+                if not st.button(label, key=f"bulk_action_{action or 'clear'}", disabled=not targets, use_container_width=True):
+                    continue
+                # 画面に表示した内容を元の値として、1回の書き込みにまとめる
+                changes = bulk_action_changes(st.session_state.get('rendered_df', df), targets, action, meeting_type)
+                queue.submit_many([(no, values, base, operation_id(no)) for no, values, base in changes])
+                st.session_state.pop("bulk_targets", None)
+                notify(f"{len(changes)}人の出欠を変更しました" if changes else "変更する出欠はありませんでした")
                 st.rerun()
+        st.caption(f"{len(targets)}人を選択中")
+
+# 一括編集モードで未回答を表すラベル
+UNANSWERED_LABEL = "未選択"
+
+def has_unsaved_bulk_edits():
+    """一括編集モードに保存していない編集があるかどうか"""
+    return any(
+        key.startswith("bulk_editor") and isinstance(value, dict) and value.get("edited_rows")
+        for key, value in st.session_state.items()
+    )
+
+def clear_bulk_edits():
+    """一括編集モードの編集内容を破棄"""
+    for key in [key for key in st.session_state if key.startswith("bulk_editor")]:
+        del st.session_state[key]
+
+def render_bulk_editor(df, queue):
+    """一括編集モード：全参加者を1つのst.data_editorで表示し、変更を1回の書き込みでまとめて保存"""
+    # st.data_editor は編集内容を行の位置で保持するため、並び順（Noの並び）が変わったら
+    # 別のキーにして編集内容を破棄する（別の参加者の行に移らないようにする）
+    editor_key = f"bulk_editor_{hash(tuple(df['No'].tolist()))}"
+    base = df[["No", "名前", "1次会", "2次会", "コメント"]].astype({"1次会": object, "2次会": object}).replace({"1次会": {"": UNANSWERED_LABEL}, "2次会": {"": UNANSWERED_LABEL}})
+    options = ["出席", "欠席", UNANSWERED_LABEL]
+    edited = st.data_editor(
+        base,
+        key=editor_key,
+        hide_index=True,
+        use_container_width=True,
+        disabled=["No", "名前", "コメント"],
+        column_config={
+            "1次会": st.column_config.SelectboxColumn("1次会", options=options, required=True),
+            "2次会": st.column_config.SelectboxColumn("2次会", options=options, required=True),
+        },
+    )
+    
+    changes = diff_cells(base, edited, columns=["1次会", "2次会"])
+    if not changes:
+        st.caption("セルを選んで出欠を変更し、「変更を保存」を押してください")
+        return
+    
+    if st.button(f"💾 変更を保存（{len(changes)}件）", type="primary", use_container_width=True):
+        # 書き込みキューにまとめて渡し、1回のbatch_updateで保存する
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        updated_at = df.set_index("No")["更新日時"]
+        by_person = {}
+        for no, col, value, base_value in changes:
+            values, base_values = by_person.setdefault(no, ({"更新日時": now}, {"更新日時": updated_at[no]}))
+            values[col] = "" if value == UNANSWERED_LABEL else value
+            base_values[col] = "" if base_value == UNANSWERED_LABEL else base_value
+        queue.submit_many([(no, values, base_values, operation_id(no)) for no, (values, base_values) in by_person.items()])
         
-        if st.button("キャンセル", key=f"dialog_cancel_{meeting_type}_{person_no}", use_container_width=True):
-            st.rerun()
+        # 保存済みの編集内容を破棄してから再描画する
+        clear_bulk_edits()
+        notify(f"{len(changes)}件の変更を保存しました")
+        st.rerun()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def list_events(spreadsheet_id):
+    """スプレッドシート内のイベント（ワークシート名）の一覧"""
+    return get_worksheet_handle(spreadsheet_id).run(lambda sheet: [worksheet.title for worksheet in sheet.spreadsheet.worksheets()])
+
+def create_event(spreadsheet_id, title):
+    """新しいイベントのワークシートをヘッダー付きで作る（エラーは呼び出し元に送出）"""
+    def create(sheet):
+        worksheet = sheet.spreadsheet.add_worksheet(title=title, rows=100, cols=len(COLUMNS))
+        worksheet.update([COLUMNS], "A1", value_input_option='RAW')
+        write_schema_version(worksheet, SCHEMA_VERSION)
+    get_worksheet_handle(spreadsheet_id).run(create)
+    list_events.clear()
+
+def switch_event():
+    """イベントを切り替えたら、前のイベントでのページ位置や操作中の状態を破棄する"""
+    for key in list(st.session_state):
+        if key == "roster_page" or key.startswith(("bulk_editor", "choose_", "confirm_delete_")):
+            del st.session_state[key]
+
+def select_event(spreadsheet_id):
+    """サイドバーでイベント（ワークシート）を選ぶ。選んだワークシート名を返す（一覧を取得できなければNone）"""
+    with st.sidebar:
+        st.header("📅 イベント")
+        try:
+            events = list_events(spreadsheet_id)
+        except Exception as e:
+            st.error(f"イベントの一覧を取得できません: {e}")
+            return None
+        
+        # 作成したイベントに切り替える（ウィジェットの値は作成前に設定する）
+        if 'event_pending' in st.session_state:
+            st.session_state['event'] = st.session_state.pop('event_pending')
+        event = st.selectbox("イベント", events, key="event", on_change=switch_event, label_visibility="collapsed")
+        
+        with st.expander("新しいイベントを作成"):
+            title = st.text_input("イベント名", key="new_event_input")
+            if st.button("作成", key="create_event", use_container_width=True):
+                if not title:
+                    st.warning("⚠️ イベント名を入力してください")
+                elif title in events:
+                    st.warning(f"⚠️ 「{title}」はすでにあります")
+                else:
+                    try:
+                        create_event(spreadsheet_id, title)
+                    except Exception as e:
+                        st.error(f"イベント作成エラー: {e}")
+                    else:
+                        switch_event()
+                        st.session_state['event_pending'] = title
+                        notify(f"イベント「{title}」を作成しました")
+                        st.rerun()
+        
+        st.markdown("---")
+    return event
+
+def open_backend():
+    """設定（storage）に応じた保存先を開く。開けない場合はエラーを表示してNoneを返す"""
+    if get_setting("storage", "sheets") == "sqlite":
+        try:
+            return get_sqlite_backend(get_setting("sqlite_path", "attendance.db"))
+        except Exception as e:
+            st.error(f"データベースを開けません: {e}")
+            return None
     
     # Google Sheetsクライアント取得
     client = get_google_sheets_client()
     if not client:
         st.error("Google Sheetsに接続できません。設定を確認してください。")
-        return
+        return None
     
     # スプレッドシートID（secretsから取得）
     try:
         spreadsheet_id = st.secrets["spreadsheet_id"]
     except:
         st.error("スプレッドシートIDが設定されていません。")
-        return
+        return None
     
-    # スプレッドシートを開く
+    # スプレッドシートを開く（ハンドルはプロセス内で使い回す）
     try:
-        spreadsheet = client.open_by_key(spreadsheet_id)
-        sheet = spreadsheet.sheet1  # 最初のシートを使用
+        get_worksheet_handle(spreadsheet_id).get()
     except Exception as e:
         st.error(f"スプレッドシートを開けません: {e}")
+        return None
+    
+    # 選んだイベントのワークシートだけを開く（他のイベントは読み込まない）
+    event = select_event(spreadsheet_id)
+    if get_setting("replica", False):
+        return get_replica_backend(spreadsheet_id, event)
+    return get_sheets_backend(spreadsheet_id, event)
+
+def notify(message, icon="✅"):
+    """次回の再実行で表示する通知を登録（session_stateでrerunをまたいで保持）"""
+    st.session_state.setdefault('notifications', []).append((message, icon))
+
+def show_notifications():
+    """登録済みの通知をトーストで表示"""
+    for message, icon in st.session_state.pop('notifications', []):
+        st.toast(message, icon=icon)
+
+# 出欠の値ごとのボタン表示（ラベル, ボタンの種類, CSSクラス）
+ATTENDANCE_BUTTONS = {
+    "出席": ("✓ 出席", "primary", ""),
+    "欠席": ("✗ 欠席", "secondary", "absent-button"),
+}
+
+def attendance_button(value, key):
+    """現在の出欠に応じた見た目のボタンを表示し、押されたかどうかを返す"""
+    button_label, button_type, button_class = ATTENDANCE_BUTTONS.get(value, ("未選択", "secondary", ""))
+    
+    # ボタンのHTMLクラスを適用
+    if button_class:
+        st.markdown(f'<div class="{button_class}">', unsafe_allow_html=True)
+    clicked = st.button(button_label, key=key, type=button_type, use_container_width=True)
+    if button_class:
+        st.markdown('</div>', unsafe_allow_html=True)
+    return clicked
+
+def operation_id(no):
+    """変更の記録で同じ操作を見分けるID（No・セッション・時刻）"""
+    session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+    return f"{no}:{session_id}:{time.time_ns()}"
+
+def set_attendance(queue, values, meeting_type, attendance):
+    """1人分の出欠をキューに追加し、自動更新の比較対象にも反映する"""
+    person_no = values["No"]
+    # 他の端末の変更と競合していないかを書き込み時に確認するため、編集前の値も渡す
+    base = {meeting_type: values[meeting_type], "更新日時": values["更新日時"]}
+    changes = {meeting_type: attendance, "更新日時": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    # 画面には即時反映し、書き込みはバックグラウンドで行う
+    queue.submit(person_no, changes, base, op_id=operation_id(person_no))
+    
+    # 自分の変更の保存を「他の端末の変更」と見なして全体を再描画しないようにする
+    rendered_df = st.session_state.get('rendered_df')
+    if rendered_df is not None:
+        rendered_df = rendered_df.copy(deep=False)
+        for col, value in changes.items():
+            rendered_df.loc[rendered_df["No"] == person_no, col] = value
+        st.session_state['rendered_df'] = rendered_df
+
+def current_row(backend, queue, row):
+    """1人分の最新の値 {列名: 値} を返す
+    
+    行のフラグメントは前回の全体描画の row のまま再実行されるため、書き込み後の内容は
+    プロセスで共有する読み込み（変更がなければキャッシュ）から取り直し、未保存の変更を重ねる。
+    読み込めない場合や他の端末で削除された場合は row を使う。
+    """
+    try:
+        df = backend.load()
+        latest = df[df["No"] == row["No"]]
+    except Exception:
+        latest = None
+    values = latest.iloc[0].to_dict() if latest is not None and len(latest) else row.to_dict()
+    return {**values, **queue.pending_values(row["No"])}
+
+@st.fragment
+def render_roster_row(row, backend):
+    """参加者1人分の行（この行の操作では、この行だけを再実行する）"""
+    show_notifications()
+    # キューはイベントが使われていない間に破棄されることがあるため、実行のたびに取得する
+    queue = get_write_queue(backend.key, backend)
+    person_no = row["No"]
+    values = current_row(backend, queue, row)
+    choose_key = f"choose_{person_no}"
+    confirm_key = f"confirm_delete_{person_no}"
+    
+    # データ行コンテナの開始
+    st.markdown('<div class="attendance-row-container">', unsafe_allow_html=True)
+    
+    # Streamlitのカラム機能を使用（CSSで幅を制御）
+    cols = st.columns([8, 25, 25, 25, 10])
+    
+    # No
+    with cols[0]:
+        st.markdown(f'<div style="text-align: center; padding: 0.3rem 0; font-size: 0.9rem;">{person_no}</div>', unsafe_allow_html=True)
+    
+    # 名前
+    with cols[1]:
+        st.markdown(f'<div style="text-align: center; font-weight: bold; padding: 0.3rem 0; font-size: 0.9rem;">{values["名前"]}</div>', unsafe_allow_html=True)
+    
+    # 1次会・2次会ボタン（押すと行の下に出欠の選択肢を表示）
+    with cols[2]:
+        if attendance_button(values["1次会"], f"first_{person_no}"):
+            st.session_state[choose_key] = "1次会"
+            st.session_state[confirm_key] = False
+    with cols[3]:
+        if attendance_button(values["2次会"], f"second_{person_no}"):
+            st.session_state[choose_key] = "2次会"
+            st.session_state[confirm_key] = False
+    
+    # 削除ボタン
+    with cols[4]:
+        if st.button("🗑️", key=f"delete_{person_no}", help="削除", use_container_width=True):
+            st.session_state[confirm_key] = True
+            st.session_state[choose_key] = None
+    
+    # データ行コンテナの終了
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # 出欠の選択
+    meeting_type = st.session_state.get(choose_key)
+    if meeting_type:
+        st.markdown(f"**{values['名前']}さんの{meeting_type}出欠を選択してください**")
+        col_attend, col_absent, col_cancel = st.columns(3)
+        attendance = None
+        with col_attend:
+            if st.button("✓ 出席", key=f"choose_attend_{meeting_type}_{person_no}", type="primary", use_container_width=True):
+                attendance = "出席"
+        with col_absent:
+            if st.button("✗ 欠席", key=f"choose_absent_{meeting_type}_{person_no}", use_container_width=True):
+                attendance = "欠席"
+        with col_cancel:
+            if st.button("キャンセル", key=f"choose_cancel_{meeting_type}_{person_no}", use_container_width=True):
+                st.session_state[choose_key] = None
+                rerun_fragment()
+        if attendance:
+            set_attendance(queue, values, meeting_type, attendance)
+            st.session_state[choose_key] = None
+            notify(f"{values['名前']}さんの{meeting_type}を{attendance}にしました")
+            rerun_fragment()
+    
+    # 削除確認
+    if st.session_state.get(confirm_key):
+        st.warning(f"⚠️ {values['名前']}さんを削除しますか？")
+        col_yes, col_no = st.columns(2)
+        with col_yes:
+            if st.button("はい", key=f"yes_{person_no}", type="primary"):
+                if delete_participant(backend, person_no):
+                    st.session_state[confirm_key] = False
+                    notify(f"{values['名前']}さんを削除しました")
+                    # 行数とページ構成が変わるため全体を再描画する
+                    st.rerun()
+        with col_no:
+            if st.button("いいえ", key=f"no_{person_no}"):
+                st.session_state[confirm_key] = False
+                rerun_fragment()
+    
+    # 各行の下に薄い線を追加（選択中・削除確認中は表示しない）
+    if not meeting_type and not st.session_state.get(confirm_key):
+        st.markdown('<hr style="margin: 0.3rem 0; border: none; border-top: 1px solid #eee;">', unsafe_allow_html=True)
+
+@st.fragment
+def render_add_participant(backend):
+    """サイドバーの参加者追加フォーム（入力中はフォームだけを再実行する）"""
+    st.header("➕ 新規参加者追加")
+    new_name = st.text_input("名前", key="new_name_input")
+    if st.button("追加", type="primary", use_container_width=True):
+        if new_name:
+            if add_participant(backend, new_name) is not None:
+                notify(f"{new_name}さんを追加しました！")
+                st.rerun()
+        else:
+            st.warning("⚠️ 名前を入力してください")
+    
+    with st.expander("📥 まとめて追加"):
+        file_types = ["csv", "xlsx"] if openpyxl is not None else ["csv"]
+        upload = st.file_uploader("名簿ファイル", type=file_types, key="import_file",
+                                  help="1行目に「名前」列があればその列を、なければ1列目を読み込みます")
+        pasted = st.text_area("または名前を1行に1人ずつ貼り付け", key="import_text")
+        if st.button("まとめて追加", use_container_width=True):
+            existing = {name_key(name) for name in load_data(backend)["名前"]}
+            if upload is not None:
+                names, skipped = read_import_file(upload, existing)
+            else:
+                names, skipped = import_names(csv.reader(io.StringIO(pasted), delimiter="\t"), existing)
+            if not names:
+                st.warning(f"⚠️ 追加する名前がありません（重複 {skipped}件）" if skipped else "⚠️ 名前を入力してください")
+            elif add_participants(backend, names) is not None:
+                notify(f"{len(names)}人を追加しました！" + (f"（重複する{skipped}件は追加していません）" if skipped else ""))
+                st.session_state.pop("import_text", None)
+                st.rerun()
+
+def main():
+    # タイトル
+    st.markdown('<div class="header-style"><h1>📝 出席簿アプリ</h1><p>参加者の出席状況を管理</p></div>', unsafe_allow_html=True)
+    
+    # 前回の操作の通知を表示
+    show_notifications()
+    
+    # 保存先を開く（バックエンドはプロセス内で使い回す）
+    backend = open_backend()
+    if backend is None:
         return
+    queue = get_write_queue(backend.key, backend)
+    
+    # 自動更新・集計・保存状況の再描画間隔（秒、0で無効）
+    live_update_interval = float(get_setting("live_update_interval", 3))
+    stats_refresh_interval = float(get_setting("stats_refresh_interval", 1))
     
     # サイドバー
     with st.sidebar:
-        st.header("➕ 新規参加者追加")
-        new_name = st.text_input("名前", key="new_name_input")
-        if st.button("追加", type="primary", use_container_width=True):
-            if new_name:
-                df = load_data(sheet)
-                new_no = df["No"].max() + 1 if len(df) > 0 else 1
-                new_row = pd.DataFrame([{
-                    "No": new_no,
-                    "名前": new_name,
-                    "1次会": "",
-                    "2次会": "",
-                    "コメント": "",
-                    "更新日時": ""
-                }])
-                df = pd.concat([df, new_row], ignore_index=True)
-                if save_data(sheet, df):
-                    st.success(f"✅ {new_name}さんを追加しました！")
-                    time.sleep(1)
-                    st.rerun()
-            else:
-                st.warning("⚠️ 名前を入力してください")
+        render_add_participant(backend)
+        
+        st.markdown("---")
+        
+        # 表示モード
+        st.header("⚡ 表示モード")
+        bulk_mode = st.toggle("一括編集モード", key="bulk_mode", help="全参加者を1つの表で表示し、まとめて出欠を変更します")
         
         st.markdown("---")
         
@@ -734,9 +2831,16 @@ def main():
         st.header("🔄 表示順序")
         sort_option = st.selectbox(
             "並び替え",
-            ["No順", "名前順（あいうえお）", "1次会出席者優先", "2次会出席者優先"],
+            SORT_OPTIONS,
             key="sort_option"
         )
+        default_page_size = int(get_setting("page_size", 50))
+        page_size = st.selectbox(
+            "1ページの表示件数",
+            PAGE_SIZES,
+            index=PAGE_SIZES.index(default_page_size) if default_page_size in PAGE_SIZES else 1,
+            key="page_size"
+        )
         
         st.markdown("---")
         
@@ -744,63 +2848,123 @@ def main():
         if st.button("最新データを取得", use_container_width=True):
             st.rerun()
         
+        # 書き込みキューの状態（行の操作では全体が再実行されないため、定期的に更新する）
+        @st.fragment(run_every=live_update_interval or None)
+        def sync_status():
+            render_write_status(get_write_queue(backend.key, backend), "queue")
+            if isinstance(backend, ReplicaBackend):
+                if backend.synced_at is not None:
+                    st.caption(f"🔁 Google Sheetsと同期: {backend.synced_at:%H:%M:%S}")
+                if backend.last_error is not None:
+                    st.warning(f"⚠️ Google Sheetsから読み込めません（自動で再試行します）: {backend.last_error}")
+                render_write_status(backend.push_queue, "replica")
+        
+        sync_status()
+        
         st.markdown("---")
-        st.info("💡 ヒント: 複数人で同時に使用する場合は、定期的に「最新データを取得」ボタンを押してください。")
-    
-    # データ読み込み
-    df = load_data(sheet)
-    
-    # session_stateの初期化
-    if 'attendance_changed' not in st.session_state:
-        st.session_state['attendance_changed'] = False
-    if 'updated_df' not in st.session_state:
-        st.session_state['updated_df'] = None
-    
-    # 変更があった場合はデータを保存
-    if st.session_state['attendance_changed'] and st.session_state['updated_df'] is not None:
-        if save_data(sheet, st.session_state['updated_df']):
-            st.success("✅ 変更を保存しました")
-            time.sleep(0.5)
-            st.session_state['attendance_changed'] = False
-            st.session_state['updated_df'] = None
-            st.rerun()
+        st.info("💡 ヒント: 他の端末での変更は自動で反映されます。すぐに確認したい場合は「最新データを取得」ボタンを押してください。")
+    
+    # 変更通知（読み込み前のバージョンを記録し、読み込み中の変更も取りこぼさない）
+    notifier = get_change_notifier(backend.key, backend)
+    st.session_state['seen_version'] = notifier.version
+    
+    # データ読み込み（変更がなければキャッシュから）
+    df = load_data(backend)
+    
+    # 保存待ちの変更を重ねて表示（楽観的更新）
+    revision = queue.revision
+    df = queue.apply_pending(df)
+    st.session_state['rendered_df'] = df
+    
+    # 他の端末の変更を監視し、表示中の内容が変わった場合だけ再描画する
+    if live_update_interval > 0:
+        @st.fragment(run_every=live_update_interval)
+        def watch_changes():
+            # フラグメントの再実行でもイベントを使用中として扱うよう、毎回取得する
+            notifier = get_change_notifier(backend.key, backend)
+            if notifier.version == st.session_state.get('seen_version'):
+                return
+            # 一括編集の保存前に並び替わると編集内容が消えるため、保存するまで再描画しない
+            if st.session_state.get("bulk_mode") and has_unsaved_bulk_edits():
+                return
+            st.session_state['seen_version'] = notifier.version
+            latest = get_write_queue(backend.key, backend).apply_pending(load_data(backend))
+            if not latest.equals(st.session_state['rendered_df']):
+                st.rerun()
+        
+        watch_changes()
     
     if len(df) == 0:
         st.info("👥 参加者がいません。サイドバーから追加してください。")
         return
     
-    # ソート処理
+    # ソート処理（並び順はデータのバージョンごとにプロセスで共有）
     try:
-        if sort_option == "No順":
-            df = df.sort_values("No")
-        elif sort_option == "名前順（あいうえお）":
-            df = df.sort_values("名前")
-        elif sort_option == "1次会出席者優先":
-            df = df.sort_values(["1次会", "No"], ascending=[False, True])
-        elif sort_option == "2次会出席者優先":
-            df = df.sort_values(["2次会", "No"], ascending=[False, True])
-        
-        df = df.reset_index(drop=True)
+        order = get_sort_orders(backend.key).order(df, (st.session_state['seen_version'], revision), sort_option)
+        df = df.iloc[order].reset_index(drop=True)
     except Exception as e:
         st.warning(f"ソートエラー: {e}")
         # ソートに失敗してもそのまま表示を続ける
     
-    # 統計情報
-    col1, col2, col3, col4 = st.columns(4)
-    with col1:
-        st.metric("👥 総参加者数", len(df))
-    with col2:
-        first_attended = (df["1次会"] == "出席").sum()
-        st.metric("🍻 1次会出席", f"{first_attended}名")
-    with col3:
-        second_attended = (df["2次会"] == "出席").sum()
-        st.metric("🎉 2次会出席", f"{second_attended}名")
-    with col4:
-        both_attended = ((df["1次会"] == "出席") & (df["2次会"] == "出席")).sum()
-        st.metric("⭐ 両方出席", f"{both_attended}名")
+    # 統計情報（集計はプロセスで共有し、行の操作では変更された人の分だけ更新される）
+    stats = get_attendance_stats(backend.key, queue)
+    
+    @st.fragment(run_every=stats_refresh_interval or None)
+    def render_stats():
+        queue = get_write_queue(backend.key, backend)
+        stats = get_attendance_stats(backend.key, queue)
+        try:
+            summary = stats.current(get_change_notifier(backend.key, backend).version, lambda: queue.apply_pending(backend.load()))
+        except Exception as e:
+            st.error(f"データ読み込みエラー: {e}")
+            return
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("👥 総参加者数", summary["総参加者数"])
+        with col2:
+            st.metric("🍻 1次会出席", f"{summary['1次会']['出席']}名")
+        with col3:
+            st.metric("🎉 2次会出席", f"{summary['2次会']['出席']}名")
+        with col4:
+            st.metric("⭐ 両方出席", f"{summary['両方出席']}名")
+        st.caption(
+            f"回答率 1次会 {summary['1次会']['回答率']:.0%}・2次会 {summary['2次会']['回答率']:.0%}"
+            f"　｜　未回答 1次会 {summary['1次会']['未回答']}名・2次会 {summary['2次会']['未回答']}名"
+            f"　｜　どちらか出席 {summary['どちらか出席']}名・どちらも不参加 {summary['どちらも不参加']}名"
+        )
+    
+    # 全体の再実行時は読み込み済みのデータで集計する
+    stats.current(st.session_state['seen_version'], lambda: df)
+    render_stats()
     
     st.markdown("---")
     
+    if bulk_mode:
+        render_bulk_editor(df, queue)
+        return
+    
+    # 名前検索とページ送り（統計は全件、一覧は表示中のページ分だけ描画する）
+    total_pages = -(-len(df) // page_size)
+    if st.session_state.get('roster_page', 1) > total_pages:
+        st.session_state['roster_page'] = total_pages
+    search_col, page_col = st.columns([3, 1])
+    with search_col:
+        query = st.text_input("🔍 名前で検索", key="name_search", on_change=request_jump)
+    if st.session_state.pop('jump_pending', False) and query:
+        found_page = find_page(df, query, page_size)
+        if found_page is None:
+            st.warning(f"⚠️ 「{query}」さんは見つかりませんでした")
+        else:
+            st.session_state['roster_page'] = found_page
+    with page_col:
+        page = st.number_input(f"ページ（全{total_pages}）", min_value=1, max_value=total_pages, key="roster_page")
+    render_bulk_actions(df, backend, query)
+    
+    start = (page - 1) * page_size
+    page_df = df.iloc[start:start + page_size]
+    st.caption(f"全{len(df)}名中 {start + 1}〜{start + len(page_df)}名を表示")
+    
     # ヘッダー行
     st.markdown("""
     <div class="attendance-header">
@@ -812,106 +2976,9 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    # 出席簿フォーム
-    for idx, row in df.iterrows():
-        # データ行コンテナの開始
-        st.markdown('<div class="attendance-row-container">', unsafe_allow_html=True)
-        
-        # Streamlitのカラム機能を使用（CSSで幅を制御）
-        cols = st.columns([8, 25, 25, 25, 10])
-        
-        # No
-        with cols[0]:
-            st.markdown(f'<div style="text-align: center; padding: 0.3rem 0; font-size: 0.9rem;">{row["No"]}</div>', unsafe_allow_html=True)
-        
-        # 名前
-        with cols[1]:
-            st.markdown(f'<div style="text-align: center; font-weight: bold; padding: 0.3rem 0; font-size: 0.9rem;">{row["名前"]}</div>', unsafe_allow_html=True)
-        
-        # 1次会ボタン
-        with cols[2]:
-            # 現在の状態に応じてボタンの表示を変更
-            if row["1次会"] == "出席":
-                button_label = "✓ 出席"
-                button_type = "primary"
-                button_class = ""
-            elif row["1次会"] == "欠席":
-                button_label = "✗ 欠席"
-                button_type = "secondary"
-                button_class = "absent-button"
-            else:
-                button_label = "未選択"
-                button_type = "secondary"
-                button_class = ""
-            
-            # ボタンのHTMLクラスを適用
-            if button_class:
-                st.markdown(f'<div class="{button_class}">', unsafe_allow_html=True)
-            
-            if st.button(button_label, key=f"first_{row['No']}", type=button_type, use_container_width=True):
-                select_attendance("1次会", row['No'], row['名前'], idx, df)
-            
-            if button_class:
-                st.markdown('</div>', unsafe_allow_html=True)
-        
-        # 2次会ボタン
-        with cols[3]:
-            # 現在の状態に応じてボタンの表示を変更
-            if row["2次会"] == "出席":
-                button_label = "✓ 出席"
-                button_type = "primary"
-                button_class = ""
-            elif row["2次会"] == "欠席":
-                button_label = "✗ 欠席"
-                button_type = "secondary"
-                button_class = "absent-button"
-            else:
-                button_label = "未選択"
-                button_type = "secondary"
-                button_class = ""
-            
-            # ボタンのHTMLクラスを適用
-            if button_class:
-                st.markdown(f'<div class="{button_class}">', unsafe_allow_html=True)
-            
-            if st.button(button_label, key=f"second_{row['No']}", type=button_type, use_container_width=True):
-                select_attendance("2次会", row['No'], row['名前'], idx, df)
-            
-            if button_class:
-                st.markdown('</div>', unsafe_allow_html=True)
-        
-        # 削除ボタン
-        with cols[4]:
-            confirm_key = f"confirm_delete_{row['No']}"
-            if confirm_key not in st.session_state:
-                st.session_state[confirm_key] = False
-            
-            if st.button("🗑️", key=f"delete_{row['No']}", help="削除", use_container_width=True):
-                st.session_state[confirm_key] = True
-        
-        # データ行コンテナの終了
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # 削除確認ダイアログ
-        if st.session_state[confirm_key]:
-            st.warning(f"⚠️ {row['名前']}さんを削除しますか？")
-            col_yes, col_no = st.columns(2)
-            with col_yes:
-                if st.button("はい", key=f"yes_{row['No']}", type="primary"):
-                    df = df[df["No"] != row["No"]]
-                    if save_data(sheet, df):
-                        st.session_state[confirm_key] = False
-                        st.success("✅ 削除しました")
-                        time.sleep(1)
-                        st.rerun()
-            with col_no:
-                if st.button("いいえ", key=f"no_{row['No']}"):
-                    st.session_state[confirm_key] = False
-                    st.rerun()
-        
-        # 各行の下に薄い線を追加（削除確認中は表示しない）
-        if not st.session_state[confirm_key]:
-            st.markdown('<hr style="margin: 0.3rem 0; border: none; border-top: 1px solid #eee;">', unsafe_allow_html=True)
+    # 出席簿フォーム（1行ずつ独立したフラグメントとして描画）
+    for _, row in page_df.iterrows():
+        render_roster_row(row, backend)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,190 @@
+"""操作ごとの待ち時間を計測するベンチマーク
+
+Google Sheets の代わりに fake_sheets のワークシートを使い、API 呼び出し1回ごとに
+--latency 秒の遅延を入れて計測する。
+
+    python bench.py [--size 400] [--latency 0.3] [--repeat 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+import app
+from fake_sheets import FakeHandle, make_legacy_roster, make_roster
+
+def measure(action, repeat):
+    """action を repeat 回実行し、1回あたりの平均秒数を返す"""
+    started = time.perf_counter()
+    for i in range(repeat):
+        action(i)
+    return (time.perf_counter() - started) / repeat
+
+def legacy_attendance(sheet, i):
+    """変更前の出欠クリック：保存 → sleep(0.5) → rerun で全件再読み込み"""
+    df = pd.DataFrame(sheet.get_all_records())
+    df.at[i, "1次会"] = "出席"
+    df.at[i, "更新日時"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    sheet.get_all_records()  # 保存を行う再実行でのデータ読み込み
+    sheet.clear()
+    sheet.update([df.columns.tolist()] + df.values.tolist())
+    time.sleep(0.5)
+    sheet.get_all_records()  # 保存後の再実行でのデータ読み込み
+
+def legacy_save(sheet, df):
+    """変更前の保存：シート全体を消して書き直す"""
+    sheet.clear()
+    sheet.update([df.columns.tolist()] + df.values.tolist())
+
+def legacy_add_delete(sheet, i):
+    """変更前の追加と削除：それぞれ 全件読み込み → 全体を書き直し → sleep(1) → rerun で全件再読み込み"""
+    df = pd.DataFrame(sheet.get_all_records())  # 追加を行う再実行でのデータ読み込み
+    df = pd.DataFrame(sheet.get_all_records())  # 追加ボタンの処理での読み込み
+    new_no = df["No"].max() + 1
+    df = pd.concat([df, pd.DataFrame([{"No": new_no, "名前": f"追加{i}", "1次会": "", "2次会": "", "コメント": "", "更新日時": ""}])], ignore_index=True)
+    legacy_save(sheet, df)
+    time.sleep(1)
+    df = pd.DataFrame(sheet.get_all_records())  # 追加後の再実行（削除を行う再実行を兼ねる）
+    legacy_save(sheet, df[df["No"] != new_no])
+    time.sleep(1)
+    sheet.get_all_records()  # 削除後の再実行でのデータ読み込み
+
+def legacy_read(sheet):
+    """変更前の読み込み：get_all_records の結果を毎回旧形式から読み替える"""
+    df = pd.DataFrame(sheet.get_all_records())
+    if "ID" in df.columns and "No" not in df.columns:
+        df = df.rename(columns={"ID": "No"})
+    if "出席" in df.columns and "1次会" not in df.columns:
+        df = df.rename(columns={"出席": "1次会"})
+        df["2次会"] = ""
+    for col in app.COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+    for col in ["1次会", "2次会"]:
+        df[col] = df[col].astype(str).replace({"TRUE": "出席", "FALSE": "", "nan": ""})
+    return df[app.COLUMNS]
+
+def bench_attendance(size, latency, repeat):
+    """出欠クリック1回あたりの待ち時間（変更前 / 変更後）"""
+    sheet = make_roster(size, latency=latency)
+    before = measure(lambda i: legacy_attendance(sheet, i), repeat)
+
+    backend = app.SheetsBackend(FakeHandle(make_roster(size, latency=latency)), app.DataCache(ttl=30))
+    queue = app.WriteBehindQueue(backend, flush_interval=0.2)
+    backend.load()
+    def action(i):
+        no = i + 1
+        queue.submit(no, {"1次会": "出席", "更新日時": time.strftime("%Y-%m-%d %H:%M:%S")}, {"1次会": "", "更新日時": ""})
+        queue.apply_pending(backend.load())  # 変更後の再実行（1回）
+    after = measure(action, repeat)
+    return before, after
+
+def bench_add_delete(size, latency, repeat):
+    """参加者1人の追加と削除（1組）にかかる待ち時間（変更前 / 変更後）"""
+    sheet = make_roster(size, latency=latency)
+    before = measure(lambda i: legacy_add_delete(sheet, i), repeat)
+
+    backend = app.SheetsBackend(FakeHandle(make_roster(size, latency=latency)), app.DataCache(ttl=30))
+    backend.load()
+    def action(i):
+        new_no = backend.append(f"追加{i}")
+        backend.load()  # 追加後の再実行（トースト通知のみで待たない）
+        backend.delete(new_no)
+        backend.load()  # 削除後の再実行
+    after = measure(action, repeat)
+    return before, after
+
+def bench_storage(size, latency, repeat):
+    """保存先ごとの読み込み・書き込み1回あたりの時間（Google Sheets / SQLite）"""
+    sheets = app.SheetsBackend(FakeHandle(make_roster(size, latency=latency)), app.DataCache(ttl=0))
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = app.SQLiteBackend(os.path.join(tmp, "bench.db"))
+        for i in range(size):
+            sqlite.append(f"参加者{i + 1}")
+
+        results = []
+        for backend in (sheets, sqlite):
+            load = measure(lambda i: backend.load(), repeat)
+            update = measure(lambda i: backend.update_cells([
+                (i + 1, "1次会", "出席", ""),
+                (i + 1, "更新日時", time.strftime("%Y-%m-%d %H:%M:%S"), ""),
+            ]), repeat)
+            results.append((load, update))
+    return results
+
+def bench_migration(size, latency, repeat):
+    """旧形式のシートの読み込み1回あたりの時間（移行前：毎回読み替え / 移行後）と、移行1回にかかる時間"""
+    sheet = make_legacy_roster(size, latency=latency)
+    before = measure(lambda i: legacy_read(sheet), repeat)
+    migration = measure(lambda i: app.migrate_sheet(sheet), 1)
+    after = measure(lambda i: app.read_data(sheet, app.SCHEMA_VERSION), repeat)
+    return before, after, migration
+
+def bench_offline(size, latency, repeat):
+    """接続が切れている間の出欠クリック1回あたりの待ち時間と、接続が戻ってから送り終えるまでの時間
+
+    offline_mode と同じく変更の記録（CheckinJournal）を付けた書き込みキューを使い、
+    fake_sheets の offline で接続を切る。切断中も名簿が表示され、再接続後に全件が書き込まれることも確認する。
+    """
+    sheet = make_roster(size, latency=latency)
+    backend = app.SheetsBackend(FakeHandle(sheet), app.DataCache(ttl=0))
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = app.CheckinJournal(os.path.join(tmp, "journal.db"))
+        queue = app.WriteBehindQueue(backend, flush_interval=0.2, journal=journal)
+        backend.load()
+
+        sheet.spreadsheet.offline = True
+        def action(i):
+            queue.submit(i + 1, {"1次会": "出席", "更新日時": time.strftime("%Y-%m-%d %H:%M:%S")}, {"1次会": "", "更新日時": ""})
+            df = queue.apply_pending(backend.load())  # 変更後の再実行（最後に読めた内容を表示）
+            if len(df) != size:
+                raise RuntimeError(f"切断中の名簿が{len(df)}人になりました（{size}人のはず）")
+        checkin = measure(action, repeat)
+
+        sheet.spreadsheet.offline = False
+        started = time.perf_counter()
+        queue.retry_now()
+        while journal.pending(backend.key):
+            if time.perf_counter() - started > 60:
+                raise RuntimeError("再接続後60秒以内に送り終わりませんでした")
+            time.sleep(0.01)
+        replay = time.perf_counter() - started
+        queue.close()
+
+    written = sum(1 for row in sheet.rows[1:repeat + 1] if row[2] == "出席")
+    if written != repeat:
+        raise RuntimeError(f"再接続後に書き込まれた変更が{written}件でした（{repeat}件のはず）")
+    return checkin, replay
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=400, help="参加者数")
+    parser.add_argument("--latency", type=float, default=0.3, help="API呼び出し1回あたりの遅延（秒）")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数")
+    args = parser.parse_args()
+
+    print(f"参加者数={args.size} API遅延={args.latency}s 計測回数={args.repeat}")
+    print(f"{'操作':<16}{'変更前(s)':>12}{'変更後(s)':>12}")
+    for name, bench in [("出欠クリック", bench_attendance), ("追加・削除", bench_add_delete)]:
+        before, after = bench(args.size, args.latency, args.repeat)
+        print(f"{name:<16}{before:>12.3f}{after:>12.3f}")
+
+    print()
+    print(f"{'保存先':<16}{'読み込み(s)':>12}{'書き込み(s)':>12}")
+    for name, (load, update) in zip(["Google Sheets", "SQLite"], bench_storage(args.size, args.latency, args.repeat)):
+        print(f"{name:<16}{load:>12.3f}{update:>12.3f}")
+
+    print()
+    before, after, migration = bench_migration(args.size, args.latency, args.repeat)
+    print(f"{'旧形式のシート':<16}{'移行前(s)':>12}{'移行後(s)':>12}{'移行(s)':>12}")
+    print(f"{'読み込み':<16}{before:>12.3f}{after:>12.3f}{migration:>12.3f}")
+
+    print()
+    checkin, replay = bench_offline(args.size, args.latency, args.repeat)
+    print(f"{'接続が切れた状態':<16}{'受付(s)':>12}{'再送(s)':>12}")
+    print(f"{'出欠クリック':<16}{checkin:>12.3f}{replay:>12.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""ローカル検証用のGoogle Sheets互換ワークシート
+
+アプリが使う gspread の Worksheet / Spreadsheet のメソッドだけをメモリ上で再現する。
+latency を指定すると、API呼び出しごとにネットワーク往復相当の待ち時間を入れる。
+offline を True にすると、接続が切れた状態として API 呼び出しが ConnectionError になる。
+"""
+import threading
+import time
+
+from gspread.utils import a1_to_rowcol
+
+HEADER = ["No", "名前", "1次会", "2次会", "コメント", "更新日時"]
+LEGACY_HEADER = ["ID", "名前", "出席", "コメント", "更新日時"]
+
+class FakeSpreadsheet:
+    """Spreadsheet の代わり（更新のたびに modifiedTime が進む）"""
+
+    def __init__(self, spreadsheet_id="fake", latency=0.0):
+        self.id = spreadsheet_id
+        self.latency = latency
+        self.modified = 0
+        self.calls = []
+        self.offline = False
+        self.sheets = []
+        self.developer_metadata = {}  # (sheetId, metadataKey) -> metadataValue
+
+    @property
+    def sheet1(self):
+        return self.sheets[0]
+
+    def worksheets(self):
+        self._call("worksheets")
+        return list(self.sheets)
+
+    def worksheet(self, title):
+        self._call("worksheet")
+        for sheet in self.sheets:
+            if sheet.title == title:
+                return sheet
+        raise KeyError(title)
+
+    def add_worksheet(self, title, rows=100, cols=26, index=None):
+        self._call("add_worksheet")
+        self.modified += 1
+        return FakeWorksheet(spreadsheet=self, title=title)
+
+    def get_lastUpdateTime(self):
+        self._call("get_lastUpdateTime")
+        return str(self.modified)
+
+    def fetch_sheet_metadata(self, params=None):
+        self._call("fetch_sheet_metadata")
+        return {"spreadsheetId": self.id, "sheets": [{
+            "properties": {"sheetId": sheet.id, "title": sheet.title},
+            "developerMetadata": [
+                {"metadataKey": key, "metadataValue": value}
+                for (sheet_id, key), value in self.developer_metadata.items() if sheet_id == sheet.id
+            ],
+        } for sheet in self.sheets]}
+
+    def values_batch_get(self, ranges, params=None):
+        """ワークシート名だけの範囲（シート全体）に対応"""
+        self._call("values_batch_get")
+        value_ranges = []
+        for range_name in ranges:
+            title = range_name[1:-1].replace("''", "'") if range_name.startswith("'") else range_name
+            sheet = next(sheet for sheet in self.sheets if sheet.title == title)
+            with sheet._lock:
+                values = [[str(v) for v in row] for row in sheet.rows]
+            value_ranges.append({"range": range_name, "values": values})
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+    def batch_update(self, body):
+        """開発者メタデータの作成・削除だけに対応"""
+        self._call("batch_update")
+        self.modified += 1
+        for request in body["requests"]:
+            if "createDeveloperMetadata" in request:
+                metadata = request["createDeveloperMetadata"]["developerMetadata"]
+                self.developer_metadata[(metadata["location"]["sheetId"], metadata["metadataKey"])] = metadata["metadataValue"]
+            elif "deleteDeveloperMetadata" in request:
+                lookup = request["deleteDeveloperMetadata"]["dataFilter"]["developerMetadataLookup"]
+                self.developer_metadata.pop((lookup["metadataLocation"]["sheetId"], lookup["metadataKey"]), None)
+        return {}
+
+    def _call(self, name):
+        if self.offline:
+            raise ConnectionError(f"offline: {name}")
+        self.calls.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+class FakeWorksheet:
+    """Worksheet の代わり（値はすべてメモリ上の2次元リストに保持）"""
+
+    def __init__(self, rows=None, spreadsheet=None, title="Sheet1"):
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+        self.spreadsheet_id = self.spreadsheet.id
+        self.title = title
+        self.rows = [list(row) for row in rows or []]
+        self._lock = threading.Lock()
+        self.id = len(self.spreadsheet.sheets)
+        self.spreadsheet.sheets.append(self)
+
+    @property
+    def calls(self):
+        return self.spreadsheet.calls
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        with self._lock:
+            if len(self.rows) < 2:
+                return []
+            header = self.rows[0]
+            return [dict(zip(header, self._pad(row, len(header)))) for row in self.rows[1:]]
+
+    def get_all_values(self):
+        return self.get_values()
+
+    def get_values(self, range_name=None, **kwargs):
+        self._call("get_values")
+        with self._lock:
+            width = max((len(row) for row in self.rows), default=0)
+            return [[str(v) for v in self._pad(row, width)] for row in self.rows]
+
+    def row_values(self, row, **kwargs):
+        self._call("row_values")
+        with self._lock:
+            return [str(v) for v in self.rows[row - 1]] if row <= len(self.rows) else []
+
+    def col_values(self, col, **kwargs):
+        self._call("col_values")
+        with self._lock:
+            return [str(row[col - 1]) if len(row) >= col else "" for row in self.rows]
+
+    def batch_get(self, ranges, **kwargs):
+        self._call("batch_get")
+        with self._lock:
+            result = []
+            for range_name in ranges:
+                start, _, end = range_name.partition(":")
+                (row, col), (_, last_col) = a1_to_rowcol(start), a1_to_rowcol(end or start)
+                cells = self.rows[row - 1][col - 1:last_col] if row <= len(self.rows) else []
+                result.append([[str(v) for v in cells]] if cells else [])
+            return result
+
+    def clear(self):
+        self._call("clear")
+        with self._lock:
+            self.rows = []
+
+    def update(self, values, range_name=None, **kwargs):
+        self._call("update")
+        with self._lock:
+            self.rows = [list(row) for row in values]
+
+    def batch_update(self, data, **kwargs):
+        self._call("batch_update")
+        with self._lock:
+            for item in data:
+                row, col = a1_to_rowcol(item["range"].split(":")[0])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set(row + i, col + j, value)
+
+    def append_row(self, values, **kwargs):
+        self._call("append_row")
+        with self._lock:
+            self.rows.append(list(values))
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows")
+        with self._lock:
+            self.rows.extend(list(row) for row in values)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call("delete_rows")
+        with self._lock:
+            del self.rows[start_index - 1:end_index or start_index]
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        target = self.rows[row - 1]
+        while len(target) < col:
+            target.append("")
+        target[col - 1] = value
+
+    def _call(self, name):
+        self.spreadsheet._call(name)
+        if name not in ("get_all_records", "get_values", "batch_get", "row_values", "col_values"):
+            self.spreadsheet.modified += 1
+
+    @staticmethod
+    def _pad(row, width):
+        return list(row) + [""] * (width - len(row))
+
+class FakeHandle:
+    """WorksheetHandle の代わり（開き直しは行わない）"""
+
+    def __init__(self, sheet, worksheet=None):
+        self.sheet = sheet
+        self.spreadsheet_id = sheet.spreadsheet_id
+        self.worksheet = worksheet
+
+    def get(self):
+        return self.sheet
+
+    def invalidate(self, error=None):
+        pass
+
+    def run(self, fn, *args):
+        return fn(self.sheet, *args)
+
+def make_roster(size, spreadsheet_id="fake", latency=0.0):
+    """size 人分の参加者が入ったワークシートを作る"""
+    rows = [HEADER] + [[no, f"参加者{no}", "", "", "", ""] for no in range(1, size + 1)]
+    return FakeWorksheet(rows, FakeSpreadsheet(spreadsheet_id, latency))
+
+def make_legacy_roster(size, spreadsheet_id="fake", latency=0.0):
+    """旧形式（ID/名前/出席/コメント/更新日時、出席はTRUE/FALSE）のワークシートを作る"""
+    rows = [LEGACY_HEADER] + [[no, f"参加者{no}", "TRUE" if no % 2 else "FALSE", "", ""] for no in range(1, size + 1)]
+    return FakeWorksheet(rows, FakeSpreadsheet(spreadsheet_id, latency))
@@ -0,0 +1,35 @@
+"""旧形式（ID/出席）のシートを現行の列構成に移行する
+
+.streamlit/secrets.toml の認証情報とスプレッドシートIDを使う。移行済みのシートは何もしない。
+アプリも未移行のシートを最初に読み込んだときに自動で移行する（auto_migrate = false で無効）。
+
+    python migrate.py [--worksheet シート名] [--dry-run]
+"""
+import argparse
+
+import streamlit as st
+
+import app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--worksheet", help="移行するワークシート名（省略時は最初のシート）")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに移行内容だけを表示する")
+    args = parser.parse_args()
+
+    handle = app.get_worksheet_handle(st.secrets["spreadsheet_id"], args.worksheet)
+    _, plan = handle.run(app.migrate_sheet, None, args.dry_run)
+
+    if plan["schema_version"] == app.SCHEMA_VERSION:
+        print(f"移行済みです（スキーマ {app.SCHEMA_VERSION}）")
+        return
+    print(f"ヘッダー: {plan['header']} → {app.COLUMNS}")
+    print(f"行数: {plan['rows']}")
+    print("シート全体を書き直します" if plan["rewrite"] else "列構成は現行のため、スキーマのバージョンだけを記録します")
+    if args.dry_run:
+        print("（--dry-run のため書き込みは行っていません）")
+    else:
+        print(f"スキーマ {app.SCHEMA_VERSION} に移行しました")
+
+if __name__ == "__main__":
+    main()